@@ -1,4 +1,7 @@
+import time
+
 import aqt
+from aqt.operations import CollectionOp
 from aqt.qt import *
 
 from .languages import Language
@@ -6,34 +9,26 @@ from . import config
 from . import note_type_mgr
 from . import util
 from .migaku_connection import ConnectionStatusLabel
+from .syntax_fingerprints import syntax_fingerprints
+from .main_window_refresh import main_window_refresh
 
 
 class AddRemoveSyntaxDialog(QDialog):
     BATCH_SIZE = 100
 
-    INITIAL_SIZE = (430, 370)
+    # Syntax batches are pipelined, several are in flight at once and their size
+    # adapts to how fast the extension answers
+    MIN_BATCH_SIZE = 10
+    MAX_BATCH_SIZE = 500
+    MAX_IN_FLIGHT = 4
+    REQUEST_TIMEOUT = 30
+    # timed out batches are split and retried this many times
+    MAX_RETRIES = 3
 
-    class RemoveThread(QThread):
-        finished = pyqtSignal()
-        progress = pyqtSignal(int)
-
-        def __init__(self, lang: Language, note_ids, field_names, parent=None):
-            super().__init__(parent)
-            self.lang = lang
-            self.note_ids = note_ids
-            self.field_names = field_names
-
-        def run(self):
-            for i, note_id in enumerate(self.note_ids):
-                note = aqt.mw.col.get_note(note_id)
-                if note:
-                    for field_name in self.field_names:
-                        text = self.lang.remove_syntax(note[field_name])
-                        note[field_name] = text
-                    note.flush()
-                if i % AddRemoveSyntaxDialog.BATCH_SIZE == 0:
-                    self.progress.emit(i)
-            self.finished.emit()
+    # number of notes written to the collection at once
+    WRITE_CHUNK_SIZE = 500
+
+    INITIAL_SIZE = (430, 370)
 
     def __init__(self, lang: Language, is_remove: bool, note_ids, parent=None):
         super().__init__(parent)
@@ -47,7 +42,14 @@ class AddRemoveSyntaxDialog(QDialog):
 
         self.checked_fields = set()
         self.current_idx = 0
-        self.current_batch_notes = []
+        self.done_count = 0
+        self.batch_size = self.BATCH_SIZE
+        self.in_flight = 0
+        self.retry_batches = []
+        self.failed = False
+        self.pending_notes = []
+        self.writes_in_flight = 0
+        self.checkpoint_id = None
 
         window_title = (
             f"Remove {lang.name_en} Language Syntax"
@@ -94,7 +96,7 @@ class AddRemoveSyntaxDialog(QDialog):
 
     def accept(self):
         self.update_last_checked_config()
-        aqt.mw.reset()
+        main_window_refresh.request()
         super().accept()
 
     def update_last_checked_config(self):
@@ -122,17 +124,48 @@ class AddRemoveSyntaxDialog(QDialog):
             min=0, max=self.note_count, label=self.progress_string, parent=self
         )
 
+        # all notes changes are merged into this undo entry when done
+        self.checkpoint_id = aqt.mw.col.add_custom_undo_entry(self.progress_string)
+
         if self.is_remove:
-            self.remove_thread = self.RemoveThread(
-                self.lang, self.note_ids, self.checked_fields
-            )
-            self.remove_thread.finished.connect(self.on_finished)
-            self.remove_thread.progress.connect(self.on_progress)
-            self.remove_thread.start()
+            CollectionOp(self, self.remove_syntax).success(
+                lambda _: self.on_finished()
+            ).run_in_background()
 
         else:
             self.current_idx = 0
-            self.request_next_batch()
+            self.done_count = 0
+            self.batch_size = self.BATCH_SIZE
+            self.in_flight = 0
+            self.retry_batches = []
+            self.failed = False
+            self.pending_notes = []
+            self.writes_in_flight = 0
+            self.dispatch_batches()
+
+    def remove_syntax(self, col):
+        for i in range(0, self.note_count, self.WRITE_CHUNK_SIZE):
+            changed_notes = []
+            for note_id in self.note_ids[i : i + self.WRITE_CHUNK_SIZE]:
+                note = col.get_note(note_id)
+                if not note:
+                    continue
+                changed = False
+                for field_name in self.checked_fields:
+                    text = self.lang.remove_syntax(note[field_name])
+                    if text != note[field_name]:
+                        note[field_name] = text
+                        changed = True
+                if changed:
+                    changed_notes.append(note)
+            col.update_notes(changed_notes)
+
+            progress = min(i + self.WRITE_CHUNK_SIZE, self.note_count)
+            aqt.mw.taskman.run_on_main(lambda p=progress: self.on_progress(p))
+
+        changes = col.merge_undo_entries(self.checkpoint_id)
+        self.checkpoint_id = None
+        return changes
 
     def on_progress(self, progress):
         aqt.mw.progress.update(
@@ -142,56 +175,190 @@ class AddRemoveSyntaxDialog(QDialog):
         )
 
     def on_finished(self):
+        self.finalize_checkpoint()
         aqt.mw.progress.finish()
         self.accept()
 
-    def request_next_batch(self):
-        current_batch = self.note_ids[
-            self.current_idx : self.current_idx + self.BATCH_SIZE
-        ]
+    def finalize_checkpoint(self):
+        if not self.checkpoint_id is None:
+            aqt.mw.col.merge_undo_entries(self.checkpoint_id)
+        self.checkpoint_id = None
+
+    def dispatch_batches(self):
+        while self.in_flight < self.MAX_IN_FLIGHT and not self.failed:
+            if self.retry_batches:
+                note_ids, retries = self.retry_batches.pop()
+            elif self.current_idx < self.note_count:
+                note_ids = self.note_ids[
+                    self.current_idx : self.current_idx + self.batch_size
+                ]
+                self.current_idx += len(note_ids)
+                retries = 0
+            else:
+                break
+            self.request_batch(note_ids, retries)
+
+        self.maybe_finish()
+
+    def maybe_finish(self):
+        if self.in_flight > 0 or self.failed:
+            return
+        if self.retry_batches or self.current_idx < self.note_count:
+            return
+
+        if self.pending_notes:
+            self.write_pending_notes()
+        elif self.writes_in_flight == 0:
+            self.on_finished()
+
+    def write_pending_notes(self):
+        notes = self.pending_notes
+        self.pending_notes = []
+        self.writes_in_flight += 1
+        CollectionOp(self, lambda col: col.update_notes(notes)).success(
+            self.on_notes_written
+        ).failure(self.on_notes_write_failed).run_in_background()
+
+    def on_notes_written(self, _result):
+        self.writes_in_flight -= 1
+        if self.failed:
+            self.finalize_after_writes()
+        else:
+            self.maybe_finish()
 
+    def on_notes_write_failed(self, error):
+        self.writes_in_flight -= 1
+        if self.failed:
+            self.finalize_after_writes()
+        else:
+            self.on_batch_error(f"Saving the notes failed: {error}")
+
+    def finalize_after_writes(self):
+        # the undo entry has to cover the chunks that are still being written
+        if self.writes_in_flight == 0:
+            self.finalize_checkpoint()
+
+    def request_batch(self, note_ids, retries):
         batch = []
-        self.current_batch_notes = []
-
-        for note_id in current_batch:
-            note = aqt.mw.col.get_note(note_id)
-            if note:
-                self.current_batch_notes.append(note)
-                batch.append(
-                    {
-                        field: self.lang.remove_syntax(note[field])
-                        for field in self.checked_fields
-                    }
-                )
+        batch_notes = []
+
+        notes = [aqt.mw.col.get_note(note_id) for note_id in note_ids]
+        notes = [note for note in notes if note]
+        stripped = {
+            (note.id, field): self.lang.remove_syntax(note[field])
+            for note in notes
+            for field in self.checked_fields
+        }
+
+        # fields whose text did not change since they got syntax are skipped
+        up_to_date = syntax_fingerprints.up_to_date(
+            self.lang.code,
+            (
+                (note.id, field, note[field], stripped[(note.id, field)])
+                for note in notes
+                for field in self.checked_fields
+            ),
+        )
+
+        for note in notes:
+            note_data = {
+                field: stripped[(note.id, field)]
+                for field in self.checked_fields
+                if (note.id, field) not in up_to_date
+            }
+            if note_data:
+                batch_notes.append(note)
+                batch.append(note_data)
+
+        if not batch_notes:
+            self.done_count += len(note_ids)
+            return
+
+        self.in_flight += 1
+        request_time = time.time()
 
         aqt.mw.migaku_connection.request_syntax(
             batch,
             self.lang.code,
-            on_done=self.on_batch_delivery,
+            on_done=lambda data: self.on_batch_delivery(
+                note_ids, batch_notes, batch, data, time.time() - request_time
+            ),
             on_error=self.on_batch_error,
+            on_timeout=lambda msg: self.on_batch_timeout(note_ids, retries, msg),
             callback_on_main_thread=True,
-            timeout=10,
+            timeout=self.REQUEST_TIMEOUT,
         )
 
-    def on_batch_delivery(self, batch):
-        current_batch_size = len(self.current_batch_notes)
+    def on_batch_delivery(self, note_ids, batch_notes, sent_batch, batch, latency):
+        self.in_flight -= 1
+        if self.failed:
+            return
 
-        assert len(batch) == current_batch_size
+        if not isinstance(batch, list) or len(batch) != len(batch_notes):
+            self.on_batch_error("Received invalid syntax from the Browser Extension.")
+            return
 
-        for note, note_data in zip(self.current_batch_notes, batch):
+        # notes are only changed in memory here and written in chunks
+        fingerprints = []
+        for note, sent_data, note_data in zip(batch_notes, sent_batch, batch):
+            changed = False
             for field_name, field_text in note_data.items():
-                note[field_name] = field_text
-                note.flush()
+                if field_text is None or field_name not in sent_data:
+                    continue
+                fingerprints.append((note.id, field_name, sent_data[field_name]))
+                if field_text != note[field_name]:
+                    note[field_name] = field_text
+                    changed = True
+            if changed:
+                self.pending_notes.append(note)
+        syntax_fingerprints.record(self.lang.code, fingerprints)
+
+        if len(self.pending_notes) >= self.WRITE_CHUNK_SIZE:
+            self.write_pending_notes()
+
+        self.adapt_batch_size(latency)
+
+        self.done_count += len(note_ids)
+        self.on_progress(self.done_count)
+        self.dispatch_batches()
+
+    def adapt_batch_size(self, latency):
+        # Aim for a quarter of the timeout, so batches waiting behind others
+        # still finish in time
+        target = self.REQUEST_TIMEOUT / 4
+        if latency < target / 2:
+            batch_size = self.batch_size * 3 // 2
+        elif latency > target:
+            batch_size = self.batch_size // 2
+        else:
+            batch_size = self.batch_size
+        self.batch_size = max(self.MIN_BATCH_SIZE, min(self.MAX_BATCH_SIZE, batch_size))
 
-        self.current_idx += current_batch_size
+    def on_batch_timeout(self, note_ids, retries, msg):
+        self.in_flight -= 1
+        if self.failed:
+            return
 
-        if self.current_idx < self.note_count:
-            self.on_progress(self.current_idx)
-            self.request_next_batch()
-        else:
-            self.on_finished()
+        if retries >= self.MAX_RETRIES:
+            self.on_batch_error(msg)
+            return
+
+        # retry in smaller pieces
+        self.batch_size = max(self.MIN_BATCH_SIZE, self.batch_size // 2)
+        half = (len(note_ids) + 1) // 2
+        for part in (note_ids[:half], note_ids[half:]):
+            if part:
+                self.retry_batches.append((part, retries + 1))
+        self.dispatch_batches()
 
     def on_batch_error(self, msg):
+        if self.failed:
+            return
+        self.failed = True
+        # notes that were processed before the error are still saved
+        if self.pending_notes:
+            self.write_pending_notes()
+        self.finalize_after_writes()
         aqt.mw.progress.clear()
         util.show_critical(msg)
 
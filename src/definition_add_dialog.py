@@ -11,6 +11,7 @@ from . import config
 from . import note_type_mgr
 from . import util
 from .migaku_connection import ConnectionStatusLabel
+from .definition_cache import definition_cache
 
 
 bracket_regex = re.compile(r"\[[^\[]+?\]")
@@ -34,6 +35,13 @@ def field_words(text):
 class DefinitionAddDialog(QDialog):
     BATCH_SIZE = 15
 
+    # number of batches the extension works on at the same time
+    MAX_IN_FLIGHT = 4
+    REQUEST_TIMEOUT = 60
+
+    # number of notes written to the collection at once
+    WRITE_CHUNK_SIZE = 200
+
     def __init__(self, lang: Language, note_type: NotetypeDict, note_ids, parent=None):
         super().__init__(parent)
         self.lang = lang
@@ -42,11 +50,17 @@ class DefinitionAddDialog(QDialog):
         note_type_fields = [fld["name"] for fld in note_type["flds"]]
 
         self.current_idx = 0
-        self.delivered_batch = []
-        self.current_batch_notes = []
+        self.done_count = 0
         self.note_count = len(self.note_ids)
         self.checkpoint_id = None
 
+        # notes that search the same words share one lookup
+        self.word_groups = []
+        self.in_flight = 0
+        self.failed = False
+        self.pending_notes = []
+        self.writes_in_flight = 0
+
         self.progress_string = f"Adding {lang.name_en} Definitions"
 
         self.setWindowTitle(f"Add {lang.name_en} Definitions")
@@ -157,85 +171,186 @@ class DefinitionAddDialog(QDialog):
         self.checkpoint_id = aqt.mw.col.add_custom_undo_entry(
             f"Added {self.lang.name_en} Definitions"
         )
+        self.group_notes()
         self.current_idx = 0
-        self.request_next_batch()
-
-    def request_next_batch(self):
-        current_batch = self.note_ids[
-            self.current_idx : self.current_idx + self.BATCH_SIZE
-        ]
+        self.done_count = self.note_count - sum(
+            len(notes) for _, notes in self.word_groups
+        )
+        self.dispatch_batches()
 
-        batch = {}
-        self.current_batch_notes = []
+    def group_notes(self):
+        search_field = self.config["search_field"]
+        groups = {}
 
-        for note_id in current_batch:
+        for note_id in self.note_ids:
             note = aqt.mw.col.get_note(note_id)
-            if note:
-                self.current_batch_notes.append(note)
-                batch[str(note_id)] = field_words(note[self.config["search_field"]])
+            if not note:
+                continue
+            words = field_words(note[search_field])
+            if not words:
+                continue
+            groups.setdefault(tuple(words), []).append(note)
+
+        self.word_groups = list(groups.items())
+
+    def dispatch_batches(self):
+        while self.in_flight < self.MAX_IN_FLIGHT and not self.failed:
+            if self.current_idx >= len(self.word_groups):
+                break
+            groups = self.word_groups[
+                self.current_idx : self.current_idx + self.BATCH_SIZE
+            ]
+            self.current_idx += len(groups)
+            self.request_batch(groups)
+
+        self.maybe_finish()
+
+    def request_batch(self, groups):
+        # words that were looked up before are served from the cache
+        cached = definition_cache.get_many(
+            self.lang.code,
+            False,
+            [words for words, _ in groups],
+            aqt.mw.col.media.dir(),
+        )
+        missing_groups = []
+        for words, notes in groups:
+            definitions = cached.get(words)
+            if definitions is None:
+                missing_groups.append((words, notes))
+            else:
+                self.apply_group(notes, definitions)
+
+        if len(missing_groups) < len(groups):
+            self.on_progress(self.done_count)
+            if len(self.pending_notes) >= self.WRITE_CHUNK_SIZE:
+                self.write_pending_notes()
+
+        if not missing_groups:
+            return
+
+        # every group is requested under the id of its first note
+        batch = {str(notes[0].id): list(words) for words, notes in missing_groups}
+
+        self.in_flight += 1
 
         aqt.mw.migaku_connection.request_definitions(
             batch,
             self.lang.code,
-            on_done=self.on_batch_delivery,
+            on_done=lambda data: self.on_batch_delivery(missing_groups, data),
             on_error=self.on_batch_error,
             callback_on_main_thread=True,
-            timeout=60,
+            timeout=self.REQUEST_TIMEOUT,
         )
 
-    def on_batch_delivery(self, batch):
-        self.delivered_batch = batch
-        CollectionOp(self, self.handle_batch_delivery_data).success(
-            self.on_batch_notes_flushed
-        ).run_in_background()
-
-    def handle_batch_delivery_data(self, col):
-        batch = self.delivered_batch
-        current_batch_size = len(self.current_batch_notes)
+    def on_batch_delivery(self, groups, batch):
+        self.in_flight -= 1
+        if self.failed:
+            return
 
-        assert len(batch) == current_batch_size
+        if not isinstance(batch, dict):
+            self.on_batch_error(
+                "Received invalid definitions from the Browser Extension."
+            )
+            return
 
+        delivered = []
+        for words, notes in groups:
+            definitions = batch.get(str(notes[0].id))
+            # empty lookups are not cached, the extension may still be loading
+            # its dictionaries
+            if isinstance(definitions, dict) and any(definitions.values()):
+                delivered.append((words, definitions))
+            self.apply_group(notes, definitions)
+        definition_cache.set_many(self.lang.code, False, delivered)
+
+        if len(self.pending_notes) >= self.WRITE_CHUNK_SIZE:
+            self.write_pending_notes()
+
+        self.on_progress(self.done_count)
+        self.dispatch_batches()
+
+    def apply_group(self, notes, definitions):
+        # notes are only changed in memory here and written in chunks
+        if definitions:
+            for note in notes:
+                self.apply_definitions(note, definitions)
+            self.pending_notes.extend(notes)
+        self.done_count += len(notes)
+
+    def apply_definitions(self, note, definitions):
         mode = self.config["mode"]
 
-        for note in self.current_batch_notes:
-            note_id_str = str(note.id)
-            if note_id_str in batch:
-                for key, mapping in [
-                    ("definitions", "text"),
-                    ("googleImages", "images"),
-                    ("forvo", "word_audio"),
-                    ("tatoeba", "example_sentences"),
-                ]:
-                    field = self.config["mapping"][mapping]
-                    def_text = batch[note_id_str][key]
-
-                    if def_text:
-                        # Append
-                        if mode == 0:
-                            if not note[field].strip():
-                                note[field] = batch[note_id_str][key]
-                            else:
-                                note[field] += "<br><br>" + batch[note_id_str][key]
-                        # Overwrite
-                        elif mode == 1:
-                            note[field] = batch[note_id_str][key]
-                        # If Empty
-                        elif mode == 2:
-                            if not note[field].strip():
-                                note[field] = batch[note_id_str][key]
-
-        self.current_idx += current_batch_size
-        return col.update_notes(self.current_batch_notes)
-
-    def on_batch_notes_flushed(self, _result):
-        if self.current_idx < self.note_count:
-            self.on_progress(self.current_idx)
-            self.request_next_batch()
-        else:
+        for key, mapping in [
+            ("definitions", "text"),
+            ("googleImages", "images"),
+            ("forvo", "word_audio"),
+            ("tatoeba", "example_sentences"),
+        ]:
+            field = self.config["mapping"][mapping]
+            def_text = definitions.get(key)
+
+            if def_text:
+                # Append
+                if mode == 0:
+                    if not note[field].strip():
+                        note[field] = def_text
+                    else:
+                        note[field] += "<br><br>" + def_text
+                # Overwrite
+                elif mode == 1:
+                    note[field] = def_text
+                # If Empty
+                elif mode == 2:
+                    if not note[field].strip():
+                        note[field] = def_text
+
+    def maybe_finish(self):
+        if self.in_flight > 0 or self.failed:
+            return
+        if self.current_idx < len(self.word_groups):
+            return
+
+        if self.pending_notes:
+            self.write_pending_notes()
+        elif self.writes_in_flight == 0:
             self.on_finished()
 
+    def write_pending_notes(self):
+        notes = self.pending_notes
+        self.pending_notes = []
+        self.writes_in_flight += 1
+        CollectionOp(self, lambda col: col.update_notes(notes)).success(
+            self.on_notes_written
+        ).failure(self.on_notes_write_failed).run_in_background()
+
+    def on_notes_written(self, _result):
+        self.writes_in_flight -= 1
+        if self.failed:
+            self.finalize_after_writes()
+        else:
+            self.maybe_finish()
+
+    def on_notes_write_failed(self, error):
+        self.writes_in_flight -= 1
+        if self.failed:
+            self.finalize_after_writes()
+        else:
+            self.on_batch_error(f"Saving the notes failed: {error}")
+
+    def finalize_after_writes(self):
+        # the undo entry has to cover the chunks that are still being written
+        if self.writes_in_flight == 0:
+            self.finalize_checkpoint()
+
     def on_batch_error(self, msg):
-        self.finalize_checkpoint()
+        if self.failed:
+            return
+        self.failed = True
+        # notes that were processed before the error are still saved
+        if self.pending_notes:
+            self.write_pending_notes()
+        self.finalize_after_writes()
         aqt.mw.progress.clear()
         util.show_critical(msg)
 
@@ -0,0 +1,147 @@
+import json
+import os
+import re
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from .user_database import UserDatabase
+
+
+MEDIA_RE = re.compile(r"\[sound:(.*?)\]|<img[^>]*?src=[\"']?([^\"'>\s]+)")
+
+
+def media_file_names(definitions: dict) -> List[str]:
+    names = []
+    for value in definitions.values():
+        if isinstance(value, str):
+            for sound, img in MEDIA_RE.findall(value):
+                names.append(sound or img)
+    return names
+
+
+class DefinitionCache(UserDatabase):
+    """Definitions delivered by the browser extension, by language, reading type and words.
+
+    The dictionaries the extension searches are configured in the extension, so
+    entries expire after MAX_AGE and can be cleared manually when they change.
+    Least recently used entries are evicted once MAX_ENTRIES is exceeded. The size
+    is only checked every EVICT_INTERVAL stored entries to avoid counting the
+    table on every write.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS definitions (
+            lang TEXT NOT NULL,
+            reading TEXT NOT NULL,
+            words TEXT NOT NULL,
+            data TEXT NOT NULL,
+            media TEXT NOT NULL,
+            created INTEGER NOT NULL,
+            used INTEGER NOT NULL,
+            PRIMARY KEY (lang, reading, words)
+        );
+        CREATE INDEX IF NOT EXISTS definitions_used ON definitions (used);
+    """
+
+    MAX_ENTRIES = 50000
+    MAX_AGE = 30 * 24 * 60 * 60
+    LOOKUP_CHUNK_SIZE = 500
+    EVICT_INTERVAL = 1000
+
+    def __init__(self, file_name: str):
+        super().__init__(file_name)
+        self.stored_since_evict = 0
+
+    @staticmethod
+    def words_key(words) -> str:
+        return "\u001f".join(words)
+
+    def get_many(
+        self, lang: str, reading, words_list: Iterable[tuple], media_dir: str
+    ) -> Dict[tuple, Dict]:
+        """Returns the cached definitions by words. Words that are not cached or whose
+        media files are missing from media_dir are not contained in the result."""
+
+        keys = {self.words_key(words): words for words in words_list}
+        key_list = list(keys)
+        reading = str(reading)
+        cutoff = int(time.time()) - self.MAX_AGE
+        rows = []
+        # stay below SQLite's limit of query parameters
+        for i in range(0, len(key_list), self.LOOKUP_CHUNK_SIZE):
+            chunk = key_list[i : i + self.LOOKUP_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            rows.extend(
+                self.execute(
+                    f"SELECT words, data, media FROM definitions WHERE lang = ? AND reading = ? AND created >= ? AND words IN ({placeholders})",
+                    lang,
+                    reading,
+                    cutoff,
+                    *chunk,
+                )
+            )
+
+        r = {}
+        for key, data, media in rows:
+            if all(
+                os.path.exists(os.path.join(media_dir, name))
+                for name in json.loads(media)
+            ):
+                r[key] = json.loads(data)
+
+        if r:
+            now = int(time.time())
+            self.executemany(
+                "UPDATE definitions SET used = ? WHERE lang = ? AND reading = ? AND words = ?",
+                [(now, lang, reading, key) for key in r],
+            )
+
+        return {keys[key]: definitions for key, definitions in r.items()}
+
+    def set_many(self, lang: str, reading, entries: List[Tuple[tuple, Dict]]) -> None:
+        """Takes (words, definitions) tuples."""
+
+        now = int(time.time())
+        self.executemany(
+            "INSERT OR REPLACE INTO definitions (lang, reading, words, data, media, created, used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    lang,
+                    str(reading),
+                    self.words_key(words),
+                    json.dumps(definitions, ensure_ascii=False),
+                    json.dumps(media_file_names(definitions), ensure_ascii=False),
+                    now,
+                    now,
+                )
+                for words, definitions in entries
+            ],
+        )
+
+        self.stored_since_evict += len(entries)
+        if self.stored_since_evict >= self.EVICT_INTERVAL:
+            self.evict()
+
+    def evict(self) -> None:
+        self.stored_since_evict = 0
+        self.execute(
+            "DELETE FROM definitions WHERE created < ?",
+            int(time.time()) - self.MAX_AGE,
+        )
+        (count,) = self.first("SELECT count() FROM definitions")
+        if count <= self.MAX_ENTRIES:
+            return
+        self.execute(
+            "DELETE FROM definitions WHERE rowid IN (SELECT rowid FROM definitions ORDER BY used ASC LIMIT ?)",
+            count - self.MAX_ENTRIES,
+        )
+
+    def clear(self) -> None:
+        self.execute("DELETE FROM definitions")
+
+    def count(self) -> int:
+        (count,) = self.first("SELECT count() FROM definitions")
+        return count
+
+
+definition_cache = DefinitionCache("definition_cache.sqlite")
@@ -12,6 +12,7 @@ from ..languages import Language
 from ..note_type_mgr import nt_get_lang
 from ..util import addon_path, show_critical
 from ..migaku_fields import get_migaku_fields
+from ..syntax_fingerprints import syntax_fingerprints
 
 
 def editor_get_lang(editor: Editor):
@@ -53,6 +54,11 @@ def editor_generate_syntax(editor: Editor):
                 if new_text:
                     note.fields[field_idx] = new_text
                     editor.loadNoteKeepingFocus()
+                    if note.id:
+                        field_name = note.keys()[field_idx]
+                        syntax_fingerprints.record(
+                            lang.code, [(note.id, field_name, text)]
+                        )
 
         aqt.mw.migaku_connection.request_syntax(
             [{note_id_key: text}],
@@ -22,6 +22,7 @@ from aqt.qt import *
 from aqt.utils import KeyboardModifiersPressed, tr, showWarning
 
 from .note_type_mgr import nt_get_lang
+from .syntax_fingerprints import syntax_fingerprints
 from . import util
 from .util import addon_path, addon_web_uri
 from . import config
@@ -139,6 +140,7 @@ def handle_inplace_edit(reviewer: Reviewer, message: str):
 
     def on_syntax_delivery(result):
         set_content(result[0][field_name], f"Add {lang.name_en} Syntax")
+        syntax_fingerprints.record(lang.code, [(note.id, field_name, field_content)])
         aqt.mw.progress.finish()
 
     def on_syntax_error(msg):
@@ -153,11 +155,18 @@ def handle_inplace_edit(reviewer: Reviewer, message: str):
         lang = nt_get_lang(card.note_type())
         if lang is None:
             return
+        stripped_content = lang.remove_syntax(field_content)
+        # the field already has syntax for its current text
+        if syntax_fingerprints.up_to_date(
+            lang.code, [(note.id, field_name, field_content, stripped_content)]
+        ):
+            set_content(field_content)
+            return
         if not aqt.mw.migaku_connection.is_connected():
             util.show_critical("Anki is not connected to the Browser Extension.")
             return
         aqt.mw.progress.start(label=f"Adding {lang.name_en} syntax to field...")
-        field_content = lang.remove_syntax(field_content)
+        field_content = stripped_content
         aqt.mw.migaku_connection.request_syntax(
             [{field_name: field_content}],
             lang.code,
@@ -0,0 +1,52 @@
+import time
+
+import aqt
+from aqt.qt import QTimer
+
+
+class MainWindowRefresh:
+    """Coalesces main window resets requested by the add-on.
+
+    Requests are merged into one aqt.mw.reset once no new request came in for
+    INTERVAL_MS, or at the latest MAX_DELAY_MS after the first one. While the main
+    window is minimized or hidden the reset waits until it is shown again.
+
+    Must be used from the main thread.
+    """
+
+    INTERVAL_MS = 100
+    MAX_DELAY_MS = 1000
+    HIDDEN_RETRY_MS = 1000
+
+    def __init__(self):
+        self.timer = None
+        self.first_request = None
+        self.requested = 0
+        self.resets = 0
+
+    def request(self) -> None:
+        if self.timer is None:
+            self.timer = QTimer(aqt.mw)
+            self.timer.setSingleShot(True)
+            self.timer.timeout.connect(self._fire)
+
+        self.requested += 1
+        now = time.monotonic()
+        if self.first_request is None:
+            self.first_request = now
+        elif (now - self.first_request) * 1000 >= self.MAX_DELAY_MS:
+            # a steady stream of requests must not postpone the reset forever
+            return
+        self.timer.start(self.INTERVAL_MS)
+
+    def _fire(self) -> None:
+        if not aqt.mw.isVisible() or aqt.mw.isMinimized():
+            self.timer.start(self.HIDDEN_RETRY_MS)
+            return
+
+        self.first_request = None
+        self.resets += 1
+        aqt.mw.reset()
+
+
+main_window_refresh = MainWindowRefresh()
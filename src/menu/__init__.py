@@ -11,6 +11,9 @@ from . import (
     dayoff_window,
     vacation_window,
     export_logs,
+    clear_definition_cache,
+    clear_syntax_cache,
+    clear_upload_cache,
 )
 
 menu = QMenu("Migaku", aqt.mw)
@@ -47,6 +50,9 @@ deckItem.triggered.connect(deckTrigger)
 def setup_menu():
     menu.addAction(settings_window.action)
     menu.addAction(export_logs.action)
+    menu.addAction(clear_definition_cache.action)
+    menu.addAction(clear_syntax_cache.action)
+    menu.addAction(clear_upload_cache.action)
 
     menu.addSeparator()
     menu.addAction(ease_reset.action)
@@ -7,6 +7,7 @@ from aqt.qt import QAction
 from anki.decks import DeckConfigId
 
 from .scheduler_func import balance, Card, Vacation
+from ..main_window_refresh import main_window_refresh
 
 
 SECOND_MS = 1000
@@ -171,7 +172,7 @@ class BalanceScheduler:
                 candidates, move_factor, schedule_factors, vacations, revs_done_today
             )
 
-        aqt.mw.reset()
+        main_window_refresh.request()
 
 
 def balance_all():
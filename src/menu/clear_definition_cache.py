@@ -0,0 +1,15 @@
+import aqt
+from aqt.qt import *
+from aqt.utils import tooltip
+
+from ..definition_cache import definition_cache
+
+
+def clear_definition_cache():
+    count = definition_cache.count()
+    definition_cache.clear()
+    tooltip(f"Cleared {count} cached definitions.")
+
+
+action = QAction("Clear Definition Cache", aqt.mw)
+action.triggered.connect(clear_definition_cache)
@@ -0,0 +1,15 @@
+import aqt
+from aqt.qt import *
+from aqt.utils import tooltip
+
+from ..migaku_connection.syntax_cache import syntax_cache
+
+
+def clear_syntax_cache():
+    count = syntax_cache.count()
+    syntax_cache.clear()
+    tooltip(f"Cleared {count} cached syntax entries.")
+
+
+action = QAction("Clear Syntax Cache", aqt.mw)
+action.triggered.connect(clear_syntax_cache)
@@ -0,0 +1,15 @@
+import aqt
+from aqt.qt import *
+from aqt.utils import tooltip
+
+from ..migaku_connection.media_upload_cache import media_upload_cache
+
+
+def clear_upload_cache():
+    count = media_upload_cache.count()
+    media_upload_cache.clear()
+    tooltip(f"Cleared {count} cached media uploads.")
+
+
+action = QAction("Clear SRS Media Upload Cache", aqt.mw)
+action.triggered.connect(clear_upload_cache)
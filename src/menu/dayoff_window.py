@@ -3,6 +3,7 @@ from aqt.qt import *
 
 from .balance_scheduler import BalanceScheduler
 from .. import util
+from ..main_window_refresh import main_window_refresh
 
 
 class BalanceSchedulerDayOffWindow(QDialog):
@@ -76,7 +77,7 @@ class BalanceSchedulerDayOffWindow(QDialog):
         bsched = BalanceScheduler(aqt.mw.col)
         bsched.balance_all()
 
-        aqt.mw.reset()
+        main_window_refresh.request()
 
         super().accept()
 
@@ -6,6 +6,9 @@ import aqt
 from aqt.qt import QAction, QFileDialog
 from aqt.utils import tooltip
 
+from ..main_window_refresh import main_window_refresh
+from ..migaku_connection.syntax_cache import syntax_cache
+
 
 def export_debug_logs():
     """Export Migaku debug logs to a file for troubleshooting."""
@@ -23,6 +26,22 @@ def export_debug_logs():
         is_connected = connection.is_connected()
         log_content.append(f"Browser Extension Connected: {is_connected}")
         log_content.append("")
+
+        log_content.append("--- Extension Requests ---")
+        for key, value in connection.pending_requests.stats().items():
+            log_content.append(f"{key}: {value}")
+        log_content.append("")
+
+        log_content.append(
+            f"Main window resets: {main_window_refresh.resets}"
+            f" for {main_window_refresh.requested} requests"
+        )
+        log_content.append("")
+
+        log_content.append("--- Syntax Cache ---")
+        for key, value in syntax_cache.stats().items():
+            log_content.append(f"{key}: {value}")
+        log_content.append("")
         
         # Try to read from log file if it exists
         log_file = os.path.join(aqt.mw.pm.profileFolder(), "migaku_addon.log")
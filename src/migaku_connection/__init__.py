@@ -1,4 +1,5 @@
 import asyncio
+import concurrent.futures
 import logging
 import os
 import tornado
@@ -12,7 +13,7 @@ from ..util import DEFAULT_PORT
 from .hello import MigakuHello
 from .migaku_connector import MigakuConnector
 from .card_creator import CardCreator
-from .card_receiver import CardReceiver
+from .card_receiver import CardReceiver, CardBatchReceiver
 from .audio_condenser import AudioCondenser
 from .learning_status_handler import LearningStatusHandler
 from .profile_data_provider import ProfileDataProvider
@@ -20,11 +21,15 @@ from .program_manager import ProgramManager
 from .info_provider import InfoProvider
 from .card_send import CardSender
 from .search_handler import SearchHandler
+from .syntax_cache import syntax_cache
+from .pending_requests import PendingRequests
 from .srs_import import (
     SrsCheckHandler,
     SrsImportInfoHandler,
     SrsSampleCardHandler,
     SrsImportHandler,
+    SrsImportStatusHandler,
+    SrsImportEstimateHandler,
 )
 
 from .. import config
@@ -150,43 +155,19 @@ def with_connector_silent(func):
 
 def with_connector_msg_callback(func):
     def decorated(self, *args, **kwargs):
-        self.connector_lock.lock()
-
-        msg_id = self._get_msg_id()
-
         msg_handler = self.MessageHandler(
-            on_done=kwargs.get("on_done"),
-            on_error=kwargs.get("on_error"),
-            on_timeout=kwargs.get("on_timeout"),
-            callback_on_main_thread=kwargs.get("callback_on_main_thread", False),
+            on_done=kwargs.pop("on_done", None),
+            on_error=kwargs.pop("on_error", None),
+            on_timeout=kwargs.pop("on_timeout", None),
+            callback_on_main_thread=kwargs.pop("callback_on_main_thread", False),
         )
+        timeout = kwargs.pop("timeout", None)
 
-        self.msg_handlers[msg_id] = msg_handler
-
-        timeout = kwargs.get("timeout", None)
-        if timeout is not None:
-            loop = self.thread.loop
-            loop.call_soon_threadsafe(
-                loop.call_later, timeout, self._msg_request_timed_out, msg_id
-            )
-
-        for strip_arg in [
-            "on_done",
-            "on_error",
-            "on_timeout",
-            "callback_on_main_thread",
-            "timeout",
-        ]:
-            kwargs.pop(strip_arg, None)
-
-        kwargs["msg_id"] = msg_id
-
-        if self.connector:
-            func(self, *args, **kwargs)
-        else:
-            msg_handler.error("Browser Extension is not connected.")
-
-        self.connector_lock.unlock()
+        self.pending_requests.add(
+            msg_handler,
+            lambda msg_id: self._send_request(func, msg_id, args, kwargs),
+            timeout,
+        )
 
     return decorated
 
@@ -234,6 +215,7 @@ class MigakuConnection(QObject):
         ("/learning-statuses", LearningStatusHandler),
         ("/create", CardCreator),
         ("/receive", CardReceiver),
+        ("/receive-batch", CardBatchReceiver),
         ("/profile-data", ProfileDataProvider),
         ("/info", InfoProvider),
         ("/sendcard", CardSender),
@@ -242,6 +224,8 @@ class MigakuConnection(QObject):
         ("/srs-import-info", SrsImportInfoHandler),
         ("/srs-sample-card", SrsSampleCardHandler),
         ("/srs-import", SrsImportHandler),
+        ("/srs-import-status", SrsImportStatusHandler),
+        ("/srs-import-estimate", SrsImportEstimateHandler),
     ]
 
     PROTOCOL_VERSION = 2
@@ -265,8 +249,7 @@ class MigakuConnection(QObject):
         self.connector_lock = QMutex()
         self.connector = None
 
-        self.msg_id = 0
-        self.msg_handlers = {}
+        self.pending_requests = PendingRequests(self._call_later)
 
         try:
             logger.info("Starting Tornado web server thread...")
@@ -278,9 +261,21 @@ class MigakuConnection(QObject):
             logger.error(f"Failed to start web server: {type(e).__name__}: {e}", exc_info=True)
             raise
 
-    def _get_msg_id(self):
-        self.msg_id += 1
-        return self.msg_id
+    def _call_later(self, delay, func):
+        loop = self.thread.loop
+        loop.call_soon_threadsafe(loop.call_later, delay, func)
+
+    def _send_request(self, func, msg_id, args, kwargs):
+        self.connector_lock.lock()
+        try:
+            connector = self.connector
+            if connector:
+                func(self, *args, msg_id=msg_id, **kwargs)
+        finally:
+            self.connector_lock.unlock()
+
+        if not connector:
+            self.pending_requests.fail(msg_id, "Browser Extension is not connected.")
 
     def _set_connector(self, connector):
         self.connector_lock.lock()
@@ -294,28 +289,22 @@ class MigakuConnection(QObject):
         if self.connector == connector:
             self.connector = None
             logger.info("Browser extension WebSocket disconnected")
-            for msg_handler in self.msg_handlers.values():
-                msg_handler.error("Browser Extension disconnected.")
-            self.disconnected.emit()
+            disconnected = True
+        else:
+            disconnected = False
         self.connector_lock.unlock()
 
-    def _msg_request_timed_out(self, msg_id):
-        self.connector_lock.lock()
-        if msg_id in self.msg_handlers:
-            msg_handler = self.msg_handlers[msg_id]
-            del self.msg_handlers[msg_id]
-            msg_handler.timeout("Request timed out.")
-        self.connector_lock.unlock()
+        if disconnected:
+            self.pending_requests.fail_all("Browser Extension disconnected.")
+            self.disconnected.emit()
 
     def _recv_data(self, data):
         if "id" in data and "msg" in data:
             msg_id = data["id"]
             msg = data["msg"]
 
-            if msg_id in self.msg_handlers:
-                msg_handler = self.msg_handlers[msg_id]
-                del self.msg_handlers[msg_id]
-
+            msg_handler = self.pending_requests.pop(msg_id)
+            if msg_handler:
                 if msg == "Migaku-Deliver-Syntax":
                     card_data = data.get("data", {}).get("cardArray")
                     msg_handler.done(card_data)
@@ -371,8 +360,87 @@ class MigakuConnection(QObject):
     def send_cards(self, cards_data) -> None:
         self.connector.send_data({"msg": "Migaku-Send-Cards", "data": cards_data})
 
+    def request_syntax(
+        self,
+        data,
+        lang_code,
+        alternate_reading=False,
+        on_done=None,
+        callback_on_main_thread=False,
+        **kwargs,
+    ):
+        """Request syntax for a list of {key: text} dicts.
+
+        Texts that got syntax before are answered from the syntax cache, only the
+        remaining texts are sent to the extension.
+        """
+        lang = lang_code.split("_")[0]
+        normalized = [
+            {key: syntax_cache.normalize(text) for key, text in entry.items()}
+            for entry in data
+        ]
+        cached = syntax_cache.get_many(
+            lang,
+            alternate_reading,
+            (text for entry in normalized for text in entry.values()),
+        )
+
+        # entries with texts that are not cached, reduced to those texts
+        missing_data = []
+        for entry in normalized:
+            missing = {key: text for key, text in entry.items() if text not in cached}
+            if missing:
+                missing_data.append(missing)
+
+        def merge():
+            return [
+                {key: cached.get(text) for key, text in entry.items()}
+                for entry in normalized
+            ]
+
+        if not missing_data:
+            msg_handler = self.MessageHandler(
+                on_done=on_done, callback_on_main_thread=callback_on_main_thread
+            )
+            msg_handler.done(merge())
+            return
+
+        def on_missing_done(delivered):
+            if not isinstance(delivered, list) or len(delivered) != len(missing_data):
+                # unexpected response, leave it to the caller
+                if on_done:
+                    on_done(delivered)
+                return
+
+            new_syntax = {}
+            for missing, delivered_entry in zip(missing_data, delivered):
+                for key, text in missing.items():
+                    syntax = (
+                        delivered_entry.get(key)
+                        if isinstance(delivered_entry, dict)
+                        else None
+                    )
+                    if isinstance(syntax, str):
+                        new_syntax[text] = syntax
+            syntax_cache.set_many(lang, alternate_reading, new_syntax)
+            cached.update(new_syntax)
+
+            if on_done:
+                on_done(merge())
+
+        self._send_syntax_request(
+            missing_data,
+            lang_code,
+            alternate_reading,
+            on_done=on_missing_done,
+            callback_on_main_thread=callback_on_main_thread,
+            **kwargs,
+        )
+
     @with_connector_msg_callback
-    def request_syntax(self, data, lang_code, alternate_reading=False, msg_id=None):
+    def _send_syntax_request(
+        self, data, lang_code, alternate_reading=False, msg_id=None
+    ):
         idx = lang_code.find("_")
         if idx >= 0:
             lang_code = lang_code[:idx]
@@ -410,6 +478,70 @@ class MigakuConnection(QObject):
             }
         )
 
+    async def _request_async(self, request, *args, timeout=None, **kwargs):
+        # resolve the future on the loop that awaits it, callbacks can come from any thread
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(func, value):
+            if not future.done():
+                func(value)
+
+        def on_done(data):
+            loop.call_soon_threadsafe(resolve, future.set_result, data)
+
+        def on_error(msg="Request failed."):
+            loop.call_soon_threadsafe(
+                resolve, future.set_exception, ConnectionError(msg)
+            )
+
+        def on_timeout(msg="Request timed out."):
+            loop.call_soon_threadsafe(
+                resolve, future.set_exception, asyncio.TimeoutError(msg)
+            )
+
+        request(
+            *args,
+            on_done=on_done,
+            on_error=on_error,
+            on_timeout=on_timeout,
+            timeout=timeout,
+            **kwargs,
+        )
+        return await future
+
+    async def request_syntax_async(
+        self, data, lang_code, alternate_reading=False, timeout=None
+    ):
+        """Awaitable version of request_syntax, returns the delivered card array.
+
+        Raises ConnectionError if the extension is not connected or disconnects and
+        asyncio.TimeoutError if it does not answer in time.
+        """
+        return await self._request_async(
+            self.request_syntax,
+            data,
+            lang_code,
+            alternate_reading=alternate_reading,
+            timeout=timeout,
+        )
+
+    async def request_definitions_async(
+        self, cards, lang_code, alternate_reading=False, timeout=None
+    ):
+        """Awaitable version of request_definitions, see request_syntax_async."""
+        return await self._request_async(
+            self.request_definitions,
+            cards,
+            lang_code,
+            alternate_reading=alternate_reading,
+            timeout=timeout,
+        )
+
+    def run_on_server(self, coro) -> concurrent.futures.Future:
+        """Run a coroutine on the server loop, so the Qt side can use the async requests."""
+        return asyncio.run_coroutine_threadsafe(coro, self.thread.loop)
+
 
 aqt.mw.migaku_connection = MigakuConnection(aqt.mw)
 
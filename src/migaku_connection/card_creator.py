@@ -9,16 +9,19 @@ from .. import config
 from .. import util
 from ..inplace_editor import reviewer_reshow
 from ..editor.current_editor import get_current_note_info
+from ..main_window_refresh import main_window_refresh
 
 from .migaku_http_handler import MigakuHTTPHandler
 from .handle_files import handle_files
+from . import col_access
+from .note_batch import add_note_batch
 
 
 class CardCreator(MigakuHTTPHandler):
     TO_MP3_RE = re.compile(r"\[sound:(.*?)\.(wav|ogg)\]")
     BR_RE = re.compile(r"<br\s*/?>")
 
-    def post(self):
+    async def post(self):
         if not self.check_version():
             self.finish("Card could not be created: Version mismatch")
             return
@@ -54,7 +57,12 @@ class CardCreator(MigakuHTTPHandler):
 
         card = self.get_body_argument("card", default=None)
         if card:
-            self.create_card(card)
+            await self.create_card(card)
+            return
+
+        cards = self.get_body_argument("cards", default=None)
+        if cards:
+            await self.create_cards(cards)
             return
 
         definitions = self.get_body_argument("Migaku-Deliver-Definitions", default=None)
@@ -64,34 +72,72 @@ class CardCreator(MigakuHTTPHandler):
 
         self.finish("Invalid request.")
 
-    def create_card(self, card_data_json):
-        card_data = json.loads(card_data_json)
-
-        note_type_id = card_data["noteTypeId"]
-        note_type = aqt.mw.col.models.get(note_type_id)
-        deck_id = card_data["deckId"]
-
-        note = Note(aqt.mw.col, note_type)
-
+    def prepare_card(self, card_data):
+        fields = {}
         for field in card_data["fields"]:
             if "content" in field and field["content"]:
-                content = field["content"]
                 field_name = field["name"]
-                content = self.post_process_text(content, field_name)
-                note[field_name] = content
-
-        tags = card_data.get("tags")
+                fields[field_name] = self.post_process_text(field["content"], field_name)
+
+        return {
+            "note_type_id": card_data["noteTypeId"],
+            "deck_id": int(card_data["deckId"]),
+            "tags": card_data.get("tags"),
+            "fields": fields,
+        }
+
+    @staticmethod
+    def build_note(col, note_type_id, deck_id, tags, fields):
+        """Returns the note and the deck it belongs to, without adding it."""
+
+        note = Note(col, col.models.get(note_type_id))
+        for field_name, content in fields.items():
+            note[field_name] = content
         if tags:
             note.set_tags_from_str(tags)
+        return note, deck_id
+
+    @classmethod
+    def add_note(cls, col, **card):
+        note, deck_id = cls.build_note(col, **card)
+        note.model()["did"] = deck_id
+        col.addNote(note)
+        return note
+
+    async def create_card(self, card_data_json):
+        card = self.prepare_card(json.loads(card_data_json))
+
+        def add(col):
+            note = self.add_note(col, **card)
+            col.save()
+            main_window_refresh.request()
+            return note.id
+
+        note_id = await col_access.run_with_col(add)
+
+        handle_files(self.request.files)
+
+        self.finish(json.dumps({"id": note_id}))
+
+    async def create_cards(self, cards_data_json):
+        """Create a list of cards in one undo step, either all of them or none."""
+
+        cards = [self.prepare_card(card_data) for card_data in json.loads(cards_data_json)]
+        if not cards:
+            self.set_status(400)
+            self.finish("Invalid request: No cards given.")
+            return
+
+        def add(col):
+            # build every note first, invalid cards fail before anything is added
+            notes = [self.build_note(col, **card) for card in cards]
+            return [note.id for note in add_note_batch(col, notes)]
 
-        note.model()["did"] = int(deck_id)
-        aqt.mw.col.addNote(note)
-        aqt.mw.col.save()
-        aqt.mw.taskman.run_on_main(aqt.mw.reset)
+        note_ids = await col_access.run_with_col(add)
 
         handle_files(self.request.files)
 
-        self.finish(json.dumps({"id": note.id}))
+        self.finish(json.dumps({"ids": note_ids}))
 
     def handle_definitions(self, msg_id, definition_data):
         definitions = json.loads(definition_data)
@@ -11,20 +11,25 @@ from ..editor.current_editor import (
     get_add_cards_info,
     map_to_add_cards,
 )
+from ..main_window_refresh import main_window_refresh
 from tornado.web import RequestHandler
 
 from .migaku_http_handler import MigakuHTTPHandler
+from . import col_access
+from .note_batch import add_note_batch
 
 logger = logging.getLogger("migaku.connection.card_receiver")
 
 
 class CardReceiver(MigakuHTTPHandler):
-    def post(self: RequestHandler):
+    async def post(self: RequestHandler):
         try:
             body = json.loads(self.request.body)
             card = card_fields_from_dict(body)
             logger.debug(f"Received card creation request from {self.request.remote_ip}")
-            self.create_card(card)
+            status, response = await col_access.run(self.create_card, card)
+            self.set_status(status)
+            self.finish(response)
         except Exception as e:
             logger.error(f"Failed to process card receiver request: {e}", exc_info=True)
             self.set_status(400)
@@ -32,47 +37,60 @@ class CardReceiver(MigakuHTTPHandler):
         return
 
     def create_card(self, card: CardFields):
+        """Runs on the main thread, returns (status, response)."""
+
         if get("migakuIntercept", False) and map_to_add_cards(card):
             logger.info("Card mapped to Add Cards window (intercept mode)")
             print("Tryied to map to add cards.")
-            aqt.mw.taskman.run_on_main(
-                lambda: aqt.utils.tooltip("Mapped Migaku fields to Add cards window.")
-            )
-            self.finish(
-                json.dumps(
-                    {
-                        "success": True,
-                        "created": False,
-                    }
-                )
+            aqt.utils.tooltip("Mapped Migaku fields to Add cards window.")
+            return 200, json.dumps(
+                {
+                    "success": True,
+                    "created": False,
+                }
             )
-            return
 
         info = get_add_cards_info()
 
-        note = Note(aqt.mw.col, info["notetype"])
-        fields = info["fields"]
-
-        if not any([type != "none" for (fieldname, type) in fields.items()]):
-            logger.warning("Card creation failed: No fields configured to map to")
-            print("No fields to map to.")
-            aqt.mw.taskman.run_on_main(
-                lambda: aqt.utils.tooltip(
-                    "Could not create Migaku Card: No fields to map to."
-                )
-            )
-            self.set_status(400)
-            self.finish(
-                {
-                    "success": False,
-                    "error": "No fields to map to.",
-                }
-            )
-            return
+        if not self.has_mapped_fields(info):
+            return self.no_fields_response()
 
+        note = self.add_note(card, info)
+        aqt.mw.col.save()
+        main_window_refresh.request()
+        aqt.utils.tooltip("Migaku Card created")
+        add_cards_add_to_history(note)
+        logger.info(f"Card created successfully. Note ID: {note.id}")
+        print(f"Card created. ID: {note.id}.")
+
+        return 200, json.dumps(
+            {
+                "success": True,
+                "created": True,
+                "id": note.id,
+            }
+        )
+
+    @staticmethod
+    def has_mapped_fields(info):
+        return any([type != "none" for (fieldname, type) in info["fields"].items()])
+
+    @staticmethod
+    def no_fields_response():
+        logger.warning("Card creation failed: No fields configured to map to")
+        print("No fields to map to.")
+        aqt.utils.tooltip("Could not create Migaku Card: No fields to map to.")
+        return 400, {
+            "success": False,
+            "error": "No fields to map to.",
+        }
+
+    @staticmethod
+    def build_note(card: CardFields, info):
+        note = Note(aqt.mw.col, info["notetype"])
         addcards_note = info["note"] if "note" in info else None
 
-        for fieldname, type in fields.items():
+        for fieldname, type in info["fields"].items():
             note[fieldname] = (
                 str(getattr(card, type))
                 if type != "none"
@@ -82,22 +100,63 @@ class CardReceiver(MigakuHTTPHandler):
             )
 
         note.tags = info["tags"]
-        note.model()["did"] = int(info["deck_id"])
+        return note
 
+    @classmethod
+    def add_note(cls, card: CardFields, info):
+        note = cls.build_note(card, info)
+        note.model()["did"] = int(info["deck_id"])
         aqt.mw.col.addNote(note)
-        aqt.mw.col.save()
-        aqt.mw.taskman.run_on_main(aqt.mw.reset)
-        aqt.mw.taskman.run_on_main(lambda: aqt.utils.tooltip("Migaku Card created"))
-        aqt.mw.taskman.run_on_main(lambda: add_cards_add_to_history(note))
-        logger.info(f"Card created successfully. Note ID: {note.id}")
-        print(f"Card created. ID: {note.id}.")
+        return note
 
-        self.finish(
-            json.dumps(
-                {
-                    "success": True,
-                    "created": True,
-                    "id": note.id,
-                }
+
+class CardBatchReceiver(CardReceiver):
+    """Creates a list of cards in one undo step, either all of them or none.
+
+    Cards are always added to the collection, intercept mode only applies to single cards.
+    """
+
+    async def post(self: RequestHandler):
+        try:
+            body = json.loads(self.request.body)
+            cards = [card_fields_from_dict(card) for card in body["cards"]]
+            logger.debug(
+                f"Received {len(cards)} card creation requests from {self.request.remote_ip}"
             )
+            if not cards:
+                self.set_status(400)
+                self.finish({"success": False, "error": "No cards given."})
+                return
+            status, response = await col_access.run(self.create_cards, cards)
+            self.set_status(status)
+            self.finish(response)
+        except Exception as e:
+            logger.error(f"Failed to process card batch request: {e}", exc_info=True)
+            self.set_status(400)
+            self.finish({"success": False, "error": f"Invalid request: {str(e)}."})
+
+    def create_cards(self, cards):
+        """Runs on the main thread, returns (status, response)."""
+
+        info = get_add_cards_info()
+
+        if not self.has_mapped_fields(info):
+            return self.no_fields_response()
+
+        # build every note first, invalid cards fail before anything is added
+        deck_id = int(info["deck_id"])
+        notes = add_note_batch(
+            aqt.mw.col, [(self.build_note(card, info), deck_id) for card in cards]
+        )
+
+        for note in notes:
+            add_cards_add_to_history(note)
+        logger.info(f"{len(notes)} cards created successfully.")
+
+        return 200, json.dumps(
+            {
+                "success": True,
+                "created": True,
+                "ids": [note.id for note in notes],
+            }
         )
@@ -0,0 +1,49 @@
+import asyncio
+
+import aqt
+
+
+class CollectionNotLoaded(Exception):
+    pass
+
+
+async def run(func, *args, **kwargs):
+    """Run func on the Qt main thread and await its result on the calling loop.
+
+    Handlers access the collection only this way, so their queries neither block
+    the server loop nor race the main thread. taskman runs all closures queued
+    since its last wakeup at once, concurrent requests are batched that way.
+    """
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(set_func, value):
+        if not future.done():
+            set_func(value)
+
+    def call():
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            loop.call_soon_threadsafe(resolve, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(resolve, future.set_result, result)
+
+    aqt.mw.taskman.run_on_main(call)
+    return await future
+
+
+async def run_with_col(func, *args, **kwargs):
+    """Like run, func gets the collection as first argument.
+
+    Raises CollectionNotLoaded if no collection is open by the time func runs.
+    """
+
+    def call():
+        col = aqt.mw.col
+        if col is None:
+            raise CollectionNotLoaded()
+        return func(col, *args, **kwargs)
+
+    return await run(call)
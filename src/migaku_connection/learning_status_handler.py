@@ -1,4 +1,5 @@
 from .migaku_http_handler import MigakuHTTPHandler
+from . import col_access
 import re
 import json
 from anki.collection import Collection
@@ -24,19 +25,19 @@ class LearningStatusHandler(MigakuHTTPHandler):
     def get(self):
         self.finish("LearningStatusHandler")
 
-    def post(self):
+    async def post(self):
         if self.check_version():
             fetch_models_templates = self.get_body_argument(
                 "fetchModelsAndTemplates", default=False
             )
             if fetch_models_templates is not False:
-                self.finish(self.fetch_models_and_templates())
+                self.finish(await col_access.run(self.fetch_models_and_templates))
                 return
 
             start = self.get_body_argument("start", default=None)
             if start is not None:
                 incrementor = self.get_body_argument("incrementor", default=False)
-                self.finish(self.get_cards(start, incrementor))
+                self.finish(await self.get_cards(start, incrementor))
                 return
 
         self.finish("Invalid Request")
@@ -109,8 +110,10 @@ class LearningStatusHandler(MigakuHTTPHandler):
 
     BRACKET_RE = re.compile("\\[[^]\n\u001F]*?\\]")  # (U+001F): Unit Separator
 
-    def get_cards(self, start, incrementor):
-        cards = collection_get_next_card_batch(aqt.mw.col, start, incrementor)
+    async def get_cards(self, start, incrementor):
+        cards = await col_access.run_with_col(
+            collection_get_next_card_batch, start, incrementor
+        )
         for card in cards:
             card[1] = self.BRACKET_RE.sub("", card[1])
         return json.dumps(cards)
@@ -0,0 +1,114 @@
+import base64
+import hashlib
+import json
+import time
+from typing import Optional
+
+from ..user_database import UserDatabase
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def account_key(user_token: str) -> str:
+    """Identifies the Migaku account a user token belongs to.
+
+    Uses the subject of the token, so the key stays the same when the token is
+    renewed. Tokens that cannot be decoded are identified by their hash.
+    """
+
+    try:
+        payload = user_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        subject = claims.get("sub") or claims.get("user_id")
+        if subject:
+            return "sub:" + str(subject)
+    except (IndexError, ValueError, AttributeError):
+        pass
+    return "token:" + hashlib.sha256(user_token.encode("utf-8")).hexdigest()
+
+
+class MediaUploadCache(UserDatabase):
+    """Maps Migaku account, source media content and transcode profile to the
+    uploaded r2:// path.
+
+    Media that was uploaded once is never transcoded or uploaded again, even
+    across import pages, retries and re-imports of the same deck. Uploads of one
+    account are never reused for another.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS account_uploads (
+            account TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            profile TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created INTEGER NOT NULL,
+            PRIMARY KEY (account, hash, profile)
+        );
+        CREATE TABLE IF NOT EXISTS runs (
+            source_bytes INTEGER NOT NULL,
+            seconds REAL NOT NULL,
+            created INTEGER NOT NULL
+        );
+    """
+
+    # number of recent pipeline runs the throughput is averaged over
+    THROUGHPUT_RUNS = 20
+
+    def get(self, account: str, hash_: str, profile: str) -> Optional[str]:
+        row = self.first(
+            "SELECT path FROM account_uploads WHERE account = ? AND hash = ? AND profile = ?",
+            account,
+            hash_,
+            profile,
+        )
+        return row[0] if row else None
+
+    def set(
+        self, account: str, hash_: str, profile: str, path: str, size: int
+    ) -> None:
+        self.execute(
+            "INSERT OR REPLACE INTO account_uploads (account, hash, profile, path, size, created) VALUES (?, ?, ?, ?, ?, ?)",
+            account,
+            hash_,
+            profile,
+            path,
+            size,
+            int(time.time()),
+        )
+
+    def clear(self) -> None:
+        self.execute("DELETE FROM account_uploads")
+
+    def count(self) -> int:
+        (count,) = self.first("SELECT count() FROM account_uploads")
+        return count
+
+    def add_run(self, source_bytes: int, seconds: float) -> None:
+        # runs that only hit the cache say nothing about throughput
+        if source_bytes <= 0 or seconds <= 0:
+            return
+        self.execute(
+            "INSERT INTO runs (source_bytes, seconds, created) VALUES (?, ?, ?)",
+            source_bytes,
+            seconds,
+            int(time.time()),
+        )
+        self.execute(
+            "DELETE FROM runs WHERE rowid NOT IN (SELECT rowid FROM runs ORDER BY created DESC, rowid DESC LIMIT ?)",
+            self.THROUGHPUT_RUNS,
+        )
+
+    def throughput(self) -> Optional[float]:
+        """Source bytes per second transcoded and uploaded by recent imports."""
+        row = self.first("SELECT sum(source_bytes), sum(seconds) FROM runs")
+        if not row or not row[1]:
+            return None
+        return row[0] / row[1]
+
+
+media_upload_cache = MediaUploadCache("srs_media_cache.sqlite")
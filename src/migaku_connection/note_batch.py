@@ -0,0 +1,30 @@
+from typing import List, Tuple
+
+import aqt
+from anki.notes import Note
+
+from ..main_window_refresh import main_window_refresh
+
+
+def add_note_batch(col, notes: List[Tuple[Note, int]]) -> List[Note]:
+    """Add (note, deck id) pairs in one undo step, with one save and main window reset.
+
+    Either all notes are added or none: if adding one fails the notes added before
+    it are undone and the error is raised. Must run on the main thread.
+    """
+
+    checkpoint_id = col.add_custom_undo_entry(f"Add {len(notes)} Migaku Cards")
+    try:
+        for note, deck_id in notes:
+            note.model()["did"] = deck_id
+            col.addNote(note)
+    except Exception:
+        col.merge_undo_entries(checkpoint_id)
+        col.undo()
+        raise
+
+    col.merge_undo_entries(checkpoint_id)
+    col.save()
+    main_window_refresh.request()
+    aqt.utils.tooltip(f"{len(notes)} Migaku Cards created")
+    return [note for note, _ in notes]
@@ -0,0 +1,236 @@
+import collections
+import threading
+import time
+
+
+class PendingRequest:
+    __slots__ = ("handler", "send", "deadline", "sent")
+
+    def __init__(self, handler, send, deadline):
+        self.handler = handler
+        self.send = send
+        self.deadline = deadline
+        self.sent = False
+
+
+class PendingRequests:
+    """Requests to the browser extension that wait for a reply.
+
+    Every request gets a deadline, expired requests are found by a timer wheel that
+    only ticks while requests are pending. At most MAX_IN_FLIGHT requests are sent
+    to the extension at once, further requests wait in a queue of at most
+    MAX_QUEUED requests and are rejected beyond that. Deadlines start when a
+    request is added, so waiting in the queue counts against them.
+    """
+
+    DEFAULT_TIMEOUT = 120
+    MAX_IN_FLIGHT = 32
+    MAX_QUEUED = 1000
+
+    TICK = 1.0
+    WHEEL_SIZE = 64
+
+    # ids of expired requests that are remembered to recognize late replies
+    EXPIRED_MEMORY = 1000
+
+    def __init__(self, schedule):
+        """schedule(delay, func) has to call func on the server loop after delay seconds."""
+
+        self.schedule = schedule
+        self.lock = threading.Lock()
+
+        self.msg_id = 0
+        self.requests = {}
+        self.queue = collections.deque()
+        self.in_flight = 0
+        self.draining = False
+
+        self.wheel = [set() for _ in range(self.WHEEL_SIZE)]
+        self.wheel_tick = 0
+        self.ticking = False
+
+        self.expired_ids = collections.OrderedDict()
+        self.counters = collections.Counter()
+        self.peak_in_flight = 0
+
+    def _now_tick(self, now):
+        return int(now / self.TICK)
+
+    def add(self, handler, send, timeout=None) -> None:
+        """Register a request, send(msg_id) is called once it may be sent."""
+
+        if timeout is None:
+            timeout = self.DEFAULT_TIMEOUT
+        now = time.monotonic()
+        deadline = now + timeout
+
+        with self.lock:
+            if (
+                self.in_flight >= self.MAX_IN_FLIGHT
+                and len(self.queue) >= self.MAX_QUEUED
+            ):
+                self.counters["rejected"] += 1
+                rejected = True
+            else:
+                rejected = False
+                self.msg_id += 1
+                msg_id = self.msg_id
+                self.requests[msg_id] = PendingRequest(handler, send, deadline)
+                self.queue.append(msg_id)
+                if self.in_flight >= self.MAX_IN_FLIGHT:
+                    self.counters["queued"] += 1
+                # the first tick after the deadline expires the request
+                deadline_tick = self._now_tick(deadline) + 1
+                self.wheel[deadline_tick % self.WHEEL_SIZE].add(msg_id)
+                start_ticking = not self.ticking
+                if start_ticking:
+                    self.ticking = True
+                    self.wheel_tick = self._now_tick(now)
+
+        if rejected:
+            handler.error("Too many pending requests.")
+            return
+
+        if start_ticking:
+            self.schedule(self.TICK, self.tick)
+        self._drain()
+
+    def _finish(self, msg_id):
+        request = self.requests.pop(msg_id, None)
+        if request and request.sent:
+            self.in_flight -= 1
+        return request
+
+    def pop(self, msg_id):
+        """Returns the handler for a reply, None if the request is unknown or expired."""
+
+        with self.lock:
+            request = self._finish(msg_id)
+            if request is None:
+                if msg_id in self.expired_ids:
+                    self.counters["late"] += 1
+                else:
+                    self.counters["unknown"] += 1
+                return None
+            self.counters["completed"] += 1
+
+        self._drain()
+        return request.handler
+
+    def fail(self, msg_id, msg) -> None:
+        with self.lock:
+            request = self._finish(msg_id)
+            if request:
+                self.counters["failed"] += 1
+
+        if request:
+            request.handler.error(msg)
+            self._drain()
+
+    def fail_all(self, msg) -> None:
+        with self.lock:
+            requests = list(self.requests.values())
+            self.counters["failed"] += len(requests)
+            self.requests.clear()
+            self.queue.clear()
+            self.in_flight = 0
+
+        for request in requests:
+            request.handler.error(msg)
+
+    def _drain(self) -> None:
+        # send queued requests while there is room, only one thread does this at once
+        with self.lock:
+            if self.draining:
+                return
+            self.draining = True
+
+        try:
+            while True:
+                with self.lock:
+                    request = None
+                    while self.queue and self.in_flight < self.MAX_IN_FLIGHT:
+                        msg_id = self.queue.popleft()
+                        request = self.requests.get(msg_id)
+                        if request:
+                            break
+                    if request is None:
+                        self.draining = False
+                        return
+                    request.sent = True
+                    self.in_flight += 1
+                    self.counters["sent"] += 1
+                    self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+                try:
+                    request.send(msg_id)
+                except Exception as e:
+                    # e.g. the websocket closed while the request was sent
+                    self.fail(msg_id, f"Sending the request failed: {e}")
+        except BaseException:
+            with self.lock:
+                self.draining = False
+            raise
+
+    def tick(self) -> None:
+        now = time.monotonic()
+        now_tick = self._now_tick(now)
+        expired = []
+
+        with self.lock:
+            # catch up on missed ticks, one round covers every bucket
+            first_tick = max(self.wheel_tick + 1, now_tick - self.WHEEL_SIZE + 1)
+            for tick in range(first_tick, now_tick + 1):
+                bucket = self.wheel[tick % self.WHEEL_SIZE]
+                for msg_id in list(bucket):
+                    request = self.requests.get(msg_id)
+                    if request is None:
+                        bucket.discard(msg_id)
+                    elif request.deadline <= now:
+                        # deadlines further away stay for a later round
+                        bucket.discard(msg_id)
+                        self._finish(msg_id)
+                        self.expired_ids[msg_id] = True
+                        expired.append(request)
+            self.wheel_tick = now_tick
+
+            while len(self.expired_ids) > self.EXPIRED_MEMORY:
+                self.expired_ids.popitem(last=False)
+            self.counters["expired"] += len(expired)
+
+            if self.requests:
+                keep_ticking = True
+            else:
+                keep_ticking = self.ticking = False
+                for bucket in self.wheel:
+                    bucket.clear()
+
+        if keep_ticking:
+            self.schedule(self.TICK, self.tick)
+
+        for request in expired:
+            request.handler.timeout("Request timed out.")
+        if expired:
+            self._drain()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "inFlight": self.in_flight,
+                "peakInFlight": self.peak_in_flight,
+                "queued": len(self.requests) - self.in_flight,
+                "pending": len(self.requests),
+                **{
+                    key: self.counters[key]
+                    for key in [
+                        "sent",
+                        "completed",
+                        "failed",
+                        "expired",
+                        "late",
+                        "unknown",
+                        "rejected",
+                    ]
+                },
+                "queuedTotal": self.counters["queued"],
+            }
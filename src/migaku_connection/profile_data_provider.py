@@ -1,13 +1,14 @@
 import json
 import aqt
 from .migaku_http_handler import MigakuHTTPHandler
+from . import col_access
 
 
 class ProfileDataProvider(MigakuHTTPHandler):
     def get(self):
         self.finish("LearningStatusHandler")
 
-    def post(self):
+    async def post(self):
         if self.check_version():
             if not self.is_ready():
                 self.finish('{"data": false}')
@@ -15,7 +16,7 @@ class ProfileDataProvider(MigakuHTTPHandler):
 
             fetch_data = self.get_body_argument("fetchProfileData", default=False)
             if fetch_data:
-                profile_data = self.compose_profile_data()
+                profile_data = await col_access.run(self.compose_profile_data)
                 profile_data_json = json.dumps(profile_data)
                 self.finish(profile_data_json)
                 return
@@ -23,12 +23,20 @@ class subp:
         def call(cls, *args, **kwargs):
             return subprocess.check_call(*args, **kwargs, startupinfo=cls.startupinfo)
 
+        @classmethod
+        def run(cls, *args, **kwargs):
+            return subprocess.run(*args, **kwargs, startupinfo=cls.startupinfo)
+
     else:
 
         @classmethod
         def call(cls, *args, **kwargs):
             return subprocess.check_call(*args, **kwargs)
 
+        @classmethod
+        def run(cls, *args, **kwargs):
+            return subprocess.run(*args, **kwargs)
+
 
 class ProgramManager(aqt.qt.QObject):
     BASE_DOWNLOAD_URI = "https://migaku-public-data.migaku.com/"
@@ -61,6 +69,25 @@ class ProgramManager(aqt.qt.QObject):
         assert self.is_available()
         return subp.call([self.program_path, *args], **kwargs)
 
+    def output(self, *args, input=None):
+        """Run the program and return everything it wrote to stdout.
+
+        input is passed on stdin. Raises CalledProcessError if the program fails.
+        """
+        assert self.is_available()
+        if input is not None:
+            stdin_args = {"input": input}
+        else:
+            stdin_args = {"stdin": subprocess.DEVNULL}
+        r = subp.run(
+            [self.program_path, *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            **stdin_args,
+        )
+        return r.stdout
+
     def make_available(self):
         # Attempt global installation
         if self.check_set_program_path(self.program_executable_name):
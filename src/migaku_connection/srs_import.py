@@ -1,16 +1,20 @@
 import json
+import os
 import re
-import random
 import time
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 import asyncio
 
 import aqt
+import tornado.locks
+from anki.utils import ids2str
 
 from .migaku_http_handler import MigakuHTTPHandler
 from .. import util
 
-from . import srs_util
+from . import col_access, srs_sampling, srs_util
+from .media_upload_cache import account_key, media_upload_cache
+from .srs_import_jobs import srs_import_jobs
 from .srs_util import handle_card, nt_migaku_lang
 
 
@@ -25,36 +29,73 @@ class SrsCheckHandler(MigakuHTTPHandler):
 
 
 class SrsImportInfoHandler(MigakuHTTPHandler):
-    def get(self):
-        col = aqt.mw.col
-        if col is None:
+    # the response only changes when the collection does
+    cache_key = None
+    cache_response = None
+
+    async def get(self):
+        try:
+            response = await col_access.run_with_col(self.cached_import_info)
+        except col_access.CollectionNotLoaded:
             self.clear()
             self.set_status(503)
             self.finish("Collection not loaded")
             return
 
+        self.write(response)
+
+    @staticmethod
+    def cached_import_info(col):
+        key = (col.path, col.mod)
+        if SrsImportInfoHandler.cache_key != key:
+            SrsImportInfoHandler.cache_response = SrsImportInfoHandler.import_info(col)
+            SrsImportInfoHandler.cache_key = key
+        return SrsImportInfoHandler.cache_response
+
+    @staticmethod
+    def import_info(col):
         decks = []
 
-        # [[deckId, noteTypeId, cardTypeIdx]]
+        # [[deckId, noteTypeId, cardTypeIdx, cardCount]]
         raw_deck_card_types = col.db.all(
             """
-            SELECT DISTINCT
-                cards.did, notes.mid, cards.ord
+            SELECT
+                cards.did, notes.mid, cards.ord, count()
             FROM
                 cards
             LEFT OUTER JOIN
                 notes
             ON
                 cards.nid = notes.id
+            GROUP BY
+                cards.did, notes.mid, cards.ord
         """
         )
 
-        deck_note_types = defaultdict(set)
-        deck_card_ords = defaultdict(set)
+        deck_card_counts = defaultdict(int)
+        deck_card_types = defaultdict(list)
+
+        for deckId, noteTypeId, cardTypeOrd, count in raw_deck_card_types:
+            deck_card_counts[deckId] += count
+            if noteTypeId is not None:
+                deck_card_types[deckId].append((noteTypeId, cardTypeOrd))
 
-        for deckId, noteTypeId, cardTypeOrd in raw_deck_card_types:
-            deck_note_types[deckId].add(noteTypeId)
-            deck_card_ords[(deckId, noteTypeId)].add(cardTypeOrd)
+        # noteTypeId -> (note type, field names, templates by ord, is Migaku)
+        note_type_infos = {}
+
+        def note_type_info(note_type_id):
+            if note_type_id not in note_type_infos:
+                note_type = col.models.get(note_type_id)
+                if note_type is None:
+                    note_type_infos[note_type_id] = None
+                else:
+                    note_type_infos[note_type_id] = (
+                        note_type,
+                        [f["name"] for f in note_type["flds"]],
+                        {tmpl["ord"]: tmpl for tmpl in note_type["tmpls"]},
+                        not nt_migaku_lang(note_type) is None,
+                    )
+            return note_type_infos[note_type_id]
 
         for deck_info in col.decks.all_names_and_ids(
             skip_empty_default=True, include_filtered=False
@@ -62,41 +103,35 @@ class SrsImportInfoHandler(MigakuHTTPHandler):
             deck_id = deck_info.id
             deck_name = deck_info.name
 
-            cids = col.decks.cids(deck_id, children=False)
-            card_count = len(cids)
-
             card_types = []
 
-            for note_type_id in deck_note_types[deck_id]:
-                note_type = col.models.get(note_type_id)
-                tmpls = note_type["tmpls"]
-                fields = [f["name"] for f in note_type["flds"]]
-
-                for card_ord in deck_card_ords[(deck_id, note_type_id)]:
-                    for tmpl in tmpls:
-                        if tmpl["ord"] != card_ord:
-                            continue
-                        is_migaku = not nt_migaku_lang(note_type) is None
-                        card_types.append(
-                            {
-                                "id": f"{note_type_id}\u001f{card_ord}",
-                                "name": note_type["name"] + " - " + tmpl["name"],
-                                "fields": fields,
-                                "isMigaku": is_migaku,
-                            }
-                        )
-                        break
+            for note_type_id, card_ord in deck_card_types[deck_id]:
+                info = note_type_info(note_type_id)
+                if info is None:
+                    continue
+                note_type, fields, tmpls, is_migaku = info
+                tmpl = tmpls.get(card_ord)
+                if tmpl is None:
+                    continue
+                card_types.append(
+                    {
+                        "id": f"{note_type_id}\u001f{card_ord}",
+                        "name": note_type["name"] + " - " + tmpl["name"],
+                        "fields": fields,
+                        "isMigaku": is_migaku,
+                    }
+                )
 
             decks.append(
                 {
                     "id": deck_id,
                     "name": deck_name.replace("::", " ➜ "),
-                    "cardCount": card_count,
+                    "cardCount": deck_card_counts[deck_id],
                     "cardTypes": card_types,
                 }
             )
 
-        self.write({"decks": decks})
+        return {"decks": decks}
 
 
 class SrsSampleCardHandler(MigakuHTTPHandler):
@@ -108,6 +143,10 @@ class SrsSampleCardHandler(MigakuHTTPHandler):
 
     AUDIO_AV_REF_RE = re.compile(r"\[anki:play:a:(\d+)\]")
 
+    # (card id, note mod, note type mod) -> (front html, back html)
+    html_cache = OrderedDict()
+    HTML_CACHE_SIZE = 32
+
     AUDIO_HTML = """
         <style>
             .replay-button {
@@ -190,69 +229,120 @@ class SrsSampleCardHandler(MigakuHTTPHandler):
         string = self.URL2_RE.sub(repl_url2, string)
         return string
 
-    async def post(self):
-        col = aqt.mw.col
-        if col is None:
-            self.clear()
-            self.set_status(503)
-            self.finish("Collection not loaded")
-            return
+    def find_card(self, deck_id, note_type_id, card_ord, card_id=None):
+        """Pick a random card of a card type in a deck and its subdecks.
+
+        Returns (card id, note mod) or None. If card_id is passed, only that card
+        is considered.
+        """
+
+        dids = aqt.mw.col.decks.deck_and_child_ids(deck_id)
+        card_filter = "AND cards.id = ?" if card_id else ""
+        card_args = [card_id] if card_id else []
 
+        return aqt.mw.col.db.first(
+            f"""
+            SELECT
+                cards.id, notes.mod
+            FROM
+                cards
+            JOIN
+                notes
+            ON
+                cards.nid = notes.id
+            WHERE
+                (cards.did IN {ids2str(dids)} OR cards.odid IN {ids2str(dids)})
+                AND notes.mid = ? AND cards.ord = ? {card_filter}
+            ORDER BY
+                random()
+            LIMIT 1
+        """,
+            note_type_id,
+            card_ord,
+            *card_args,
+        )
+
+    def card_html(self, card_id, note_mod, note_type_mod):
+        key = (card_id, note_mod, note_type_mod)
+        html = self.html_cache.get(key)
+        if html is not None:
+            self.html_cache.move_to_end(key)
+            return html
+
+        card = aqt.mw.col.get_card(card_id)
+
+        front_html = (
+            "<!DOCTYPE html><body>"
+            + self.AUDIO_HTML
+            + self.fix_av(self.fix_src(card.question()), card.question_av_tags())
+            + "</body></html>"
+        )
+        back_html = (
+            "<!DOCTYPE html><body>"
+            + self.AUDIO_HTML
+            + self.fix_av(self.fix_src(card.answer()), card.answer_av_tags())
+            + "</body></html>"
+        )
+
+        html = (front_html, back_html)
+        self.html_cache[key] = html
+        if len(self.html_cache) > self.HTML_CACHE_SIZE:
+            self.html_cache.popitem(last=False)
+        return html
+
+    def sample(self, col, deck_id, note_type_id, card_ord, last_card):
+        """Returns (card id, front html, back html, card snapshot) of a sample card."""
+
+        note_type = col.models.get(note_type_id)
+
+        row = None
+        if last_card and self.last_cid:
+            row = self.find_card(deck_id, note_type_id, card_ord, self.last_cid)
+        if row is None:
+            row = self.find_card(deck_id, note_type_id, card_ord)
+
+        if not row:
+            return None, "", "", None
+
+        card_id, note_mod = row
+        SrsSampleCardHandler.last_cid = card_id
+        front_html, back_html = self.card_html(card_id, note_mod, note_type["mod"])
+        snapshot = srs_util.load_cards([card_id]).get(card_id)
+        return card_id, front_html, back_html, snapshot
+
+    async def post(self):
         data = json.loads(self.request.body)
 
         deckId = int(data["deckId"])
-        deck = aqt.mw.col.decks.get(deckId, default=False)
-        deckName = deck["name"]
 
         parts = data["cardTypeId"].split("\u001f")
         noteTypeId = int(parts[0])
         cardTypeIdx = int(parts[1])
 
-        noteType = aqt.mw.col.models.get(noteTypeId)
-        noteTypeName = noteType["name"]
-
-        cardIds = aqt.mw.col.find_cards(
-            f'"note:{noteTypeName}" card:{cardTypeIdx+1} "deck:{deckName}"'
-        )
-
-        cardId = None
-        frontHtml = ""
-        backHtml = ""
-
         last_card = data.get("lastCard", False)
 
-        if cardIds:
-            if last_card and self.last_cid in cardIds:
-                cardId = SrsSampleCardHandler.last_cid
-            else:
-                cardId = random.choice(cardIds)
-                SrsSampleCardHandler.last_cid = cardId
-            card = aqt.mw.col.get_card(cardId)
-
-            frontHtml = (
-                "<!DOCTYPE html><body>"
-                + self.AUDIO_HTML
-                + self.fix_av(self.fix_src(card.question()), card.question_av_tags())
-                + "</body></html>"
-            )
-            backHtml = (
-                "<!DOCTYPE html><body>"
-                + self.AUDIO_HTML
-                + self.fix_av(self.fix_src(card.answer()), card.answer_av_tags())
-                + "</body></html>"
+        try:
+            cardId, frontHtml, backHtml, snapshot = await col_access.run_with_col(
+                self.sample, deckId, noteTypeId, cardTypeIdx, last_card
             )
+        except col_access.CollectionNotLoaded:
+            self.clear()
+            self.set_status(503)
+            self.finish("Collection not loaded")
+            return
 
         lang = data.get("lang")
         mappings = data.get("mappings")
         card_info = None
 
-        if not mappings is None and cardId:
+        if not mappings is None and cardId and snapshot:
             card_info = await handle_card(
                 cid=cardId,
                 lang=lang,
                 mappings=mappings,
                 card_types=data.get("cardTypes", []),
                 preview=True,
+                snapshot=snapshot,
             )
 
         self.write(
@@ -266,6 +356,8 @@ class SrsSampleCardHandler(MigakuHTTPHandler):
 
 
 class SrsImportHandler(MigakuHTTPHandler):
+    STREAM_CHUNK_SIZE = 25
+
     async def post(self):
         data = json.loads(self.request.body)
 
@@ -273,7 +365,7 @@ class SrsImportHandler(MigakuHTTPHandler):
         # json.dump(data, open(F'test_import_data_{t}.json', 'w'), indent=2)
 
         deck_id = int(data["deckId"])
-        offset = int(data["offset"])
+        offset = data.get("offset")
         limit = int(data["limit"])
         lang = data["lang"]
         mappings = data["mappings"]
@@ -284,133 +376,418 @@ class SrsImportHandler(MigakuHTTPHandler):
         free_trial_remaining_cards = data.get("freeTrialRemainingCards", 999999999)
         debug = data.get("debug", False)
 
-        card_ids = aqt.mw.col.findCards(f"did:{deck_id}")
-
-        if is_free_trial:
-            # If total cards are 50 or less, import them all
-            if len(card_ids) <= 50:
-                limit = min(len(card_ids), free_trial_remaining_cards)
-                card_ids = card_ids[offset : offset + limit]
-            else:
-                # Initialize cards_by_type as an empty dictionary
-                cards_by_type = {}
-
-                for cid in card_ids:
-                    card = aqt.mw.col.getCard(cid)
-                    card_type_name = card.template()["name"]
+        # Imports are tracked as jobs, passing the same job id continues the job.
+        # Without job id the unfinished job of the account, deck and language is continued.
+        try:
+            job = srs_import_jobs.get_or_create(
+                data.get("jobId"), account_key(user_token), deck_id, lang
+            )
+        except ValueError as e:
+            self.clear()
+            self.set_status(400)
+            self.finish(str(e))
+            return
 
-                    # Update cards_by_type with the fetched card type name
-                    if card_type_name not in cards_by_type:
-                        cards_by_type[card_type_name] = []
-                    cards_by_type[card_type_name].append(cid)
+        def select_cards(col):
+            """Returns (candidate card ids, total count, page size)."""
 
-                total_cards = sum(len(cards) for cards in cards_by_type.values())
+            if is_free_trial:
                 total_slots = min(50, free_trial_remaining_cards)
-                cards_to_import = {}
-
-                # First, guarantee at least one slot for each card type
-                for ctype in cards_by_type:
-                    if len(cards_by_type[ctype]) > 0:
-                        cards_to_import[ctype] = 1
-                        total_slots -= 1
-
-                # Distribute remaining slots among card types
-                while total_slots > 0:
-                    for ctype in sorted(
-                        cards_to_import,
-                        key=lambda k: len(cards_by_type[k]),
-                        reverse=True,
-                    ):
-                        if cards_to_import[ctype] < len(cards_by_type[ctype]):
-                            cards_to_import[ctype] += 1
-                            total_slots -= 1
-                            if total_slots == 0:
-                                break
-
-                # Display the number of cards to be imported for each type and the total cards for each type
-                for ctype, cards in cards_by_type.items():
-                    print(f"Total cards of type {ctype}: {len(cards)}")
-                    print(f"Importing {cards_to_import[ctype]} cards of type {ctype}")
-
-                # Fetch cards based on the calculated numbers
-                new_card_ids = []
-                for ctype, count in cards_to_import.items():
-                    new_card_ids += cards_by_type[ctype][:count]
-
-                card_ids = new_card_ids
-
+                card_type_counts = srs_sampling.card_type_counts(col.db, deck_id)
+
+                # If total cards are 50 or less, import them all
+                if sum(card_type_counts.values()) <= 50:
+                    card_ids = col.findCards(f"did:{deck_id}")
+                    count = min(len(card_ids), free_trial_remaining_cards)
+                    return card_ids[:count], count, count
+                else:
+                    card_ids = srs_sampling.sample_cards(col.db, deck_id, total_slots)
+                    return card_ids, len(card_ids), len(card_ids)
+
+            card_ids = col.findCards(f"did:{deck_id}")
+            return card_ids, len(card_ids), limit
+
+        card_ids, total_count, page_size = await col_access.run_with_col(select_cards)
+
+        if offset is None:
+            # Without offset the job continues with the cards it did not process
+            # yet, cards added to or removed from the deck do not shift the pages
+            processed = job.processed_ids(card_ids)
+            offset = len(processed)
+            card_ids = [cid for cid in card_ids if cid not in processed]
+            card_ids = card_ids[:page_size]
         else:
-            card_ids = card_ids[offset : offset + limit]
+            offset = int(offset)
+            card_ids = card_ids[offset : offset + page_size]
+
+        if job.total != total_count:
+            job.set_total(total_count)
 
         srs_util.upload_data_size = 0
+        srs_util.upload_cache_hits = 0
+
+        self.job = job
+        self.lang = lang
+        self.user_token = user_token
+        self.card_args = {
+            "lang": lang,
+            "mappings": mappings,
+            "card_types": card_types,
+            "user_token": user_token,
+            "srs_today": srs_today,
+            "preview": False,
+            "planner": srs_util.CardPlanner(
+                lang=lang, mappings=mappings, card_types=card_types
+            ),
+        }
+        self.stats = {}
+        # chunks of a streamed import build their caches one after another,
+        # so media shared between chunks is only uploaded once
+        self.cache_lock = tornado.locks.Lock()
+
+        # Get the deck name
+        deck = await col_access.run_with_col(
+            lambda col: col.decks.get(deck_id, default=False)
+        )
+        deck_name = deck["name"]
+        deck_name = deck_name.replace("::", " ➜ ")
+
+        if data.get("stream", False):
+            await self.stream_cards(card_ids, offset, deck_name, debug)
+            return
+
+        card_infos = await self.convert_cards(card_ids)
+
+        job.mark_processed(card_ids, offset + len(card_ids))
+
+        response = {
+            "count": len(card_ids),
+            "cards": card_infos,
+            "deckName": deck_name,
+            "jobId": job.id,
+            "offset": offset,
+            "nextOffset": job.next_offset,
+            "totalCount": job.total,
+        }
+
+        if debug:
+            response.update(self.debug_stats())
+
+        self.write(response)
+
+    async def stream_cards(self, card_ids, offset, deck_name, debug):
+        # Newline delimited JSON: a start line, one line per card, an end line
+        self.set_header("Content-Type", "application/x-ndjson; charset=UTF-8")
+
+        self.write_line(
+            {
+                "type": "start",
+                "count": len(card_ids),
+                "deckName": deck_name,
+                "jobId": self.job.id,
+                "offset": offset,
+                "totalCount": self.job.total,
+            }
+        )
+        await self.flush()
+
+        chunks = [
+            card_ids[i : i + self.STREAM_CHUNK_SIZE]
+            for i in range(0, len(card_ids), self.STREAM_CHUNK_SIZE)
+        ]
+
+        # the next chunk is converted while the current one is written
+        processed = 0
+        next_task = None
+        try:
+            for i, chunk in enumerate(chunks):
+                task = next_task or asyncio.ensure_future(self.convert_cards(chunk))
+                next_task = None
+                if i + 1 < len(chunks):
+                    next_task = asyncio.ensure_future(
+                        self.convert_cards(chunks[i + 1])
+                    )
+
+                try:
+                    card_infos = await task
+                except Exception as e:
+                    # the status was sent already, the client learns about the
+                    # error from the stream and can continue at nextOffset
+                    print(f"SRS import failed: {e}")
+                    self.write_line(
+                        {
+                            "type": "error",
+                            "error": str(e),
+                            "nextOffset": self.job.next_offset,
+                        }
+                    )
+                    self.finish()
+                    return
+
+                for card_info in card_infos:
+                    self.write_line({"type": "card", "card": card_info})
+                await self.flush()
+
+                processed += len(chunk)
+                self.job.mark_processed(chunk, offset + processed)
+        finally:
+            # stop converting ahead when the stream ends early
+            if next_task is not None and not next_task.cancel():
+                if not next_task.cancelled():
+                    next_task.exception()
+
+        end = {
+            "type": "end",
+            "nextOffset": self.job.next_offset,
+        }
+        if debug:
+            end.update(self.debug_stats())
+        self.write_line(end)
+        self.finish()
+
+    def write_line(self, data):
+        self.write(json.dumps(data) + "\n")
+
+    async def build_caches(self, syntax_gather, media_gather):
+        t0 = time.time()
+        job_syntax = self.job.syntax_map(text for _, text in syntax_gather)
+        syntax_cache = {
+            (self.lang, text): syntax for text, syntax in job_syntax.items()
+        }
+        new_syntax = await srs_util.build_syntax_cache(
+            {entry for entry in syntax_gather if entry not in syntax_cache}
+        )
+        syntax_cache.update(new_syntax)
+        self.job.add_syntax(
+            {text: syntax for (_, text), syntax in new_syntax.items()}
+        )
+        self.add_stat("tSyntax", time.time() - t0)
+
+        t0 = time.time()
+        media_stats = {}
+        media_cache = await srs_util.build_media_cache(
+            media_gather, self.user_token, stats=media_stats
+        )
+        self.add_stat("tMedia", time.time() - t0)
+        self.add_stat("mediaBytesSaved", media_stats.get("bytesSaved", 0))
+        self.stats.setdefault("mediaStages", []).append(media_stats)
+
+        return syntax_cache, media_cache
+
+    def add_stat(self, key, value):
+        self.stats[key] = self.stats.get(key, 0) + value
+
+    def debug_stats(self):
+        return {
+            **self.stats,
+            "uploadSize": srs_util.upload_data_size,
+            "uploadCacheHits": srs_util.upload_cache_hits,
+        }
+
+    async def convert_cards(self, card_ids):
         media_gather = set()
         syntax_gather = set()
 
+        # Load all required card, note and note type data at once
+        t0 = time.time()
+        snapshots = await col_access.run(srs_util.load_cards, card_ids)
+        self.add_stat("tLoad", time.time() - t0)
+
         # Gather media and syntax from cards
         gather_tasks = []
-        for cid in card_ids:
+        for cid in snapshots:
             task = handle_card(
                 cid=cid,
-                lang=lang,
-                mappings=mappings,
-                card_types=card_types,
-                user_token=user_token,
-                srs_today=srs_today,
-                preview=False,
                 gather_media=media_gather,
                 gather_syntax=syntax_gather,
+                snapshot=snapshots[cid],
+                **self.card_args,
             )
             gather_tasks.append(task)
 
         t0 = time.time()
         await asyncio.gather(*gather_tasks)
-        t_gather = time.time() - t0
+        self.add_stat("tGather", time.time() - t0)
 
         # Build caches
-        t0 = time.time()
-        syntax_cache = await srs_util.build_syntax_cache(syntax_gather)
-        t_syntax = time.time() - t0
-
-        t0 = time.time()
-        media_cache = await srs_util.build_media_cache(media_gather, user_token)
-        t_media = time.time() - t0
+        # Syntax resolved in earlier pages of the job is reused, uploaded media is
+        # found in the media upload cache
+        async with self.cache_lock:
+            syntax_cache, media_cache = await self.build_caches(
+                syntax_gather, media_gather
+            )
 
         # Create actual card data
         tasks = []
-        for cid in card_ids:
+        for cid in snapshots:
             task = handle_card(
                 cid=cid,
-                lang=lang,
-                mappings=mappings,
-                card_types=card_types,
-                user_token=user_token,
-                srs_today=srs_today,
-                preview=False,
                 syntax_cache=syntax_cache,
                 media_cache=media_cache,
+                snapshot=snapshots[cid],
+                **self.card_args,
             )
             tasks.append(task)
 
         t0 = time.time()
         card_infos = await asyncio.gather(*tasks)
-        card_infos = [ci for ci in card_infos if ci]
-        t_cards = time.time() - t0
+        self.add_stat("tCards", time.time() - t0)
 
-        # Get the deck name
-        deck_name = aqt.mw.col.decks.get(deck_id, default=False)["name"]
-        deck_name = deck_name.replace("::", " ➜ ")
+        return [ci for ci in card_infos if ci]
 
-        response = {
-            "count": len(card_ids),
-            "cards": card_infos,
-            "deckName": deck_name,
-        }
 
-        if debug:
-            response["tGather"] = t_gather
-            response["tSyntax"] = t_syntax
-            response["tMedia"] = t_media
-            response["tCards"] = t_cards
-            response["uploadSize"] = srs_util.upload_data_size
+class SrsImportStatusHandler(MigakuHTTPHandler):
+    def get(self):
+        job_id = self.get_argument("jobId", default=None)
+
+        if job_id:
+            job = srs_import_jobs.get(job_id)
+            if job is None:
+                self.clear()
+                self.set_status(404)
+                self.finish("Import job not found")
+                return
+            self.write(job.to_dict())
+            return
 
-        self.write(response)
+        deck_id = self.get_argument("deckId", default=None)
+        if deck_id is not None:
+            deck_id = int(deck_id)
+
+        jobs = srs_import_jobs.unfinished(deck_id)
+        self.write({"jobs": [job.to_dict() for job in jobs]})
+
+
+class SrsImportEstimateHandler(MigakuHTTPHandler):
+    """Estimates the cost of an import by running only its gather phase."""
+
+    CHUNK_SIZE = 500
+
+    # source bytes per second assumed before any import measured the real value
+    DEFAULT_THROUGHPUT = 1024 * 1024
+
+    async def post(self):
+        data = json.loads(self.request.body)
+
+        deck_id = int(data["deckId"])
+        offset = int(data.get("offset", 0))
+        limit = data.get("limit")
+        lang = data["lang"]
+
+        try:
+            card_ids = await col_access.run_with_col(
+                lambda col: col.findCards(f"did:{deck_id}")
+            )
+        except col_access.CollectionNotLoaded:
+            self.clear()
+            self.set_status(503)
+            self.finish("Collection not loaded")
+            return
+        if limit is None:
+            card_ids = card_ids[offset:]
+        else:
+            card_ids = card_ids[offset : offset + int(limit)]
+
+        planner = srs_util.CardPlanner(
+            lang=lang, mappings=data["mappings"], card_types=data["cardTypes"]
+        )
+
+        media_gather = set()
+        syntax_gather = set()
+        skipped = defaultdict(int)
+        card_count = 0
+
+        t0 = time.time()
+        for i in range(0, len(card_ids), self.CHUNK_SIZE):
+            chunk = card_ids[i : i + self.CHUNK_SIZE]
+            snapshots = await col_access.run(srs_util.load_cards, chunk)
+            if len(snapshots) < len(chunk):
+                skipped["notFound"] += len(chunk) - len(snapshots)
+
+            tasks = []
+            for cid, card in snapshots.items():
+                # skipped cards are counted here instead of being logged by handle_card
+                plan = planner.plan(card)
+                if plan.skip_code:
+                    skipped[plan.skip_code] += 1
+                    continue
+                if card.queue not in srs_util.SUPPORTED_QUEUES:
+                    skipped["unsupportedQueue"] += 1
+                    continue
+                card_count += 1
+                tasks.append(
+                    handle_card(
+                        cid=cid,
+                        lang=lang,
+                        gather_media=media_gather,
+                        gather_syntax=syntax_gather,
+                        snapshot=card,
+                        planner=planner,
+                    )
+                )
+            await asyncio.gather(*tasks)
+        t_gather = time.time() - t0
+
+        media = self.media_estimate(media_gather)
+
+        throughput = media_upload_cache.throughput()
+        throughput_measured = throughput is not None
+        if not throughput_measured:
+            throughput = self.DEFAULT_THROUGHPUT
+
+        # an import runs over the cards twice, once to gather and once to build
+        estimated_seconds = (
+            sum(media["bytes"].values()) / throughput + 2 * t_gather
+        )
+
+        self.write(
+            {
+                "totalCount": len(card_ids),
+                "cardCount": card_count,
+                "skipped": skipped,
+                "media": media,
+                "syntaxCount": len(syntax_gather),
+                "throughput": throughput,
+                "throughputMeasured": throughput_measured,
+                "tGather": t_gather,
+                "estimatedSeconds": estimated_seconds,
+            }
+        )
+
+    @staticmethod
+    def media_estimate(media_gather):
+        # Sizes are taken from the file system, reading every file to detect
+        # duplicate or already uploaded content would cost as much as the import
+        media_dir = aqt.mw.col.media.dir()
+
+        count = 0
+        remote_count = 0
+        missing_count = 0
+        transcode_count = 0
+        transcode_bytes = 0
+        bytes_by_type = {"audio": 0, "image": 0}
+
+        for src, is_audio in media_gather:
+            count += 1
+            if src.startswith("http"):
+                # size of remote media is not known before downloading it
+                remote_count += 1
+                continue
+            try:
+                size = os.path.getsize(os.path.join(media_dir, src))
+            except OSError:
+                missing_count += 1
+                continue
+            bytes_by_type["audio" if is_audio else "image"] += size
+            if srs_util.media_profile(src, is_audio) != "original":
+                transcode_count += 1
+                transcode_bytes += size
+
+        return {
+            "count": count,
+            "remoteCount": remote_count,
+            "missingCount": missing_count,
+            "bytes": bytes_by_type,
+            "transcodeCount": transcode_count,
+            "transcodeBytes": transcode_bytes,
+        }
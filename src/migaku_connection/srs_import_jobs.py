@@ -0,0 +1,211 @@
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Set
+
+from ..user_database import UserDatabase
+
+
+class SrsImportJob:
+    LOOKUP_CHUNK_SIZE = 500
+
+    def __init__(
+        self, store, id_, account, deck_id, lang, total, next_offset, created, updated
+    ):
+        self.store = store
+        self.id = id_
+        self.account = account
+        self.deck_id = deck_id
+        self.lang = lang
+        self.total = total
+        self.next_offset = next_offset
+        self.created = created
+        self.updated = updated
+
+    @property
+    def finished(self) -> bool:
+        return self.next_offset >= self.total
+
+    def set_total(self, total: int) -> None:
+        self.total = total
+        self.store.execute("UPDATE jobs SET total = ? WHERE id = ?", total, self.id)
+
+    def _lookup(self, sql, keys):
+        keys = list(keys)
+        r = {}
+        # stay below SQLite's limit of query parameters
+        for i in range(0, len(keys), self.LOOKUP_CHUNK_SIZE):
+            chunk = keys[i : i + self.LOOKUP_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            r.update(self.store.execute(sql.format(placeholders), self.id, *chunk))
+        return r
+
+    def syntax_map(self, texts: Iterable[str]) -> Dict[str, str]:
+        return self._lookup(
+            "SELECT text, syntax FROM job_syntax WHERE job_id = ? AND text IN ({})",
+            texts,
+        )
+
+    def add_syntax(self, syntax_map: Dict[str, Optional[str]]) -> None:
+        self.store.executemany(
+            "INSERT OR REPLACE INTO job_syntax (job_id, text, syntax) VALUES (?, ?, ?)",
+            [(self.id, text, syntax) for text, syntax in syntax_map.items() if syntax],
+        )
+
+    def processed_ids(self, card_ids: Iterable[int]) -> Set[int]:
+        return set(
+            self._lookup(
+                "SELECT cid, cid FROM job_cards WHERE job_id = ? AND cid IN ({})",
+                card_ids,
+            )
+        )
+
+    def mark_processed(self, card_ids: List[int], next_offset: int) -> None:
+        self.store.executemany(
+            "INSERT OR IGNORE INTO job_cards (job_id, cid) VALUES (?, ?)",
+            [(self.id, cid) for cid in card_ids],
+        )
+        self.next_offset = max(self.next_offset, next_offset)
+        self.updated = int(time.time())
+        self.store.execute(
+            "UPDATE jobs SET next_offset = ?, updated = ? WHERE id = ?",
+            self.next_offset,
+            self.updated,
+            self.id,
+        )
+
+    def processed_count(self) -> int:
+        row = self.store.first(
+            "SELECT count() FROM job_cards WHERE job_id = ?", self.id
+        )
+        return row[0]
+
+    def to_dict(self):
+        return {
+            "jobId": self.id,
+            "deckId": self.deck_id,
+            "lang": self.lang,
+            "totalCount": self.total,
+            "processedCount": self.processed_count(),
+            "nextOffset": self.next_offset,
+            "finished": self.finished,
+            "created": self.created,
+            "updated": self.updated,
+        }
+
+
+class SrsImportJobStore(UserDatabase):
+    """Progress of SRS imports, so interrupted imports can continue where they stopped.
+
+    Besides the processed cards every job keeps the syntax it already resolved, a
+    resumed import does not have to request it again. Media is not kept per job,
+    the account's media upload cache already skips files that were uploaded.
+
+    Jobs belong to the Migaku account that started them and are only continued by
+    that account.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            account TEXT NOT NULL,
+            deck_id INTEGER NOT NULL,
+            lang TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            next_offset INTEGER NOT NULL,
+            created INTEGER NOT NULL,
+            updated INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS job_cards (
+            job_id TEXT NOT NULL,
+            cid INTEGER NOT NULL,
+            PRIMARY KEY (job_id, cid)
+        );
+        CREATE TABLE IF NOT EXISTS job_syntax (
+            job_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            syntax TEXT NOT NULL,
+            PRIMARY KEY (job_id, text)
+        );
+    """
+
+    # jobs that were not continued for this long are discarded
+    MAX_AGE = 30 * 24 * 60 * 60
+
+    JOB_COLUMNS = "id, account, deck_id, lang, total, next_offset, created, updated"
+
+    def get(self, job_id: str) -> Optional[SrsImportJob]:
+        row = self.first(f"SELECT {self.JOB_COLUMNS} FROM jobs WHERE id = ?", job_id)
+        if row is None:
+            return None
+        return SrsImportJob(self, *row)
+
+    def get_or_create(
+        self, job_id: Optional[str], account: str, deck_id: int, lang: str
+    ) -> SrsImportJob:
+        """Without job_id the newest unfinished job of the account, deck and language
+        is continued.
+
+        Raises ValueError if the job with job_id belongs to another account, deck or
+        language.
+        """
+
+        if job_id:
+            job = self.get(job_id)
+            if job:
+                if job.account != account:
+                    raise ValueError(f"Import job {job_id} belongs to another account")
+                if job.deck_id != deck_id or job.lang != lang:
+                    raise ValueError(
+                        f"Import job {job_id} belongs to another deck or language"
+                    )
+                return job
+        else:
+            for job in self.unfinished(deck_id, account):
+                if job.lang == lang:
+                    return job
+            job_id = uuid.uuid4().hex
+
+        self.prune()
+
+        now = int(time.time())
+        self.execute(
+            f"INSERT INTO jobs ({self.JOB_COLUMNS}) VALUES (?, ?, ?, ?, 0, 0, ?, ?)",
+            job_id,
+            account,
+            deck_id,
+            lang,
+            now,
+            now,
+        )
+        return self.get(job_id)
+
+    def unfinished(
+        self, deck_id: Optional[int] = None, account: Optional[str] = None
+    ) -> List[SrsImportJob]:
+        rows = self.execute(
+            f"SELECT {self.JOB_COLUMNS} FROM jobs WHERE next_offset < total ORDER BY updated DESC"
+        )
+        jobs = [SrsImportJob(self, *row) for row in rows]
+        if deck_id is not None:
+            jobs = [job for job in jobs if job.deck_id == deck_id]
+        if account is not None:
+            jobs = [job for job in jobs if job.account == account]
+        return jobs
+
+    def prune(self) -> None:
+        cutoff = int(time.time()) - self.MAX_AGE
+        old_ids = [
+            (job_id,)
+            for (job_id,) in self.execute(
+                "SELECT id FROM jobs WHERE updated < ?", cutoff
+            )
+        ]
+        for table, column in [
+            ("job_cards", "job_id"),
+            ("job_syntax", "job_id"),
+            ("jobs", "id"),
+        ]:
+            self.executemany(f"DELETE FROM {table} WHERE {column} = ?", old_ids)
+
+
+srs_import_jobs = SrsImportJobStore("srs_import_jobs.sqlite")
@@ -0,0 +1,92 @@
+from typing import Dict, List, Tuple
+
+
+# (note type id, card template ord)
+CardTypeKey = Tuple[int, int]
+
+
+def card_type_counts(db, deck_id: int) -> Dict[CardTypeKey, int]:
+    rows = db.all(
+        """
+        SELECT
+            notes.mid, cards.ord, count()
+        FROM
+            cards
+        JOIN
+            notes
+        ON
+            cards.nid = notes.id
+        WHERE
+            cards.did = ? OR cards.odid = ?
+        GROUP BY
+            notes.mid, cards.ord
+        ORDER BY
+            min(cards.id)
+    """,
+        deck_id,
+        deck_id,
+    )
+    return {(mid, ord_): count for mid, ord_, count in rows}
+
+
+def distribute_slots(
+    counts: Dict[CardTypeKey, int], total_slots: int
+) -> Dict[CardTypeKey, int]:
+    # First, guarantee at least one slot for each card type
+    allocation = {key: 1 for key, count in counts.items() if count > 0}
+    remaining = total_slots - len(allocation)
+
+    # Distribute remaining slots among card types, largest card types first
+    by_size = sorted(allocation, key=lambda key: counts[key], reverse=True)
+
+    while remaining > 0:
+        distributed = False
+        for key in by_size:
+            if allocation[key] < counts[key]:
+                allocation[key] += 1
+                remaining -= 1
+                distributed = True
+                if remaining == 0:
+                    break
+        if not distributed:
+            break
+
+    return allocation
+
+
+def sample_cards(db, deck_id: int, total_slots: int) -> List[int]:
+    """Pick up to total_slots cards of a deck, at least one of every card type."""
+
+    counts = card_type_counts(db, deck_id)
+    allocation = distribute_slots(counts, total_slots)
+
+    card_ids = []
+
+    for (mid, ord_), count in allocation.items():
+        print(f"Total cards of type {mid}/{ord_}: {counts[(mid, ord_)]}")
+        print(f"Importing {count} cards of type {mid}/{ord_}")
+
+        card_ids += db.list(
+            """
+            SELECT
+                cards.id
+            FROM
+                cards
+            JOIN
+                notes
+            ON
+                cards.nid = notes.id
+            WHERE
+                (cards.did = ? OR cards.odid = ?) AND notes.mid = ? AND cards.ord = ?
+            ORDER BY
+                cards.id
+            LIMIT ?
+        """,
+            deck_id,
+            deck_id,
+            mid,
+            ord_,
+            count,
+        )
+
+    return card_ids
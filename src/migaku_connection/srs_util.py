@@ -1,23 +1,29 @@
+import asyncio
 import os
-import uuid
 import re
 import ssl
+import uuid
 import urllib3
 import requests
+import requests.adapters
 import time
 import urllib.parse
-import subprocess
+from dataclasses import dataclass, field
 from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor
+import tornado.gen
 import tornado.ioloop
-import shutil
+import tornado.queues
 
 import aqt
-from anki.utils import is_mac
+from anki.utils import ids2str
 
 from .. import note_type_mgr
 from ..languages import Languages
 from ..util import tmp_path
+from . import col_access
+from .media_upload_cache import account_key, content_hash, media_upload_cache
 
 # supports both src="" and src=''
 IMG_RE = re.compile(r"<img (.*?)src=(?:\"|')(.*?)(?:\"|')(.*?)>", re.IGNORECASE)
@@ -37,8 +43,14 @@ auto_field_map = [
 ]
 
 
+# seconds the extension gets to deliver syntax
+syntax_timeout = 120
+single_syntax_timeout = 20
+
+
 async def build_syntax_cache(entries):
-    if not aqt.mw.migaku_connection.is_connected() or not entries:
+    connection = aqt.mw.migaku_connection
+    if not connection.is_connected() or not entries:
         return {}
 
     entries_list = list(entries)
@@ -46,34 +58,17 @@ async def build_syntax_cache(entries):
 
     t = time.time()
 
-    lock = Lock()
+    try:
+        syntax_data = await connection.request_syntax_async(
+            [{"42": e[1]} for e in entries_list], lang, timeout=syntax_timeout
+        )
+    except (ConnectionError, asyncio.TimeoutError) as e:
+        print("syntax failed:", e)
+        return {}
 
     result = {}
-
-    def on_done(syntax_data):
-        nonlocal result
-        if isinstance(syntax_data, list) and len(syntax_data) == len(entries_list):
-            result = {e: syntax_data[i]["42"] for i, e in enumerate(entries_list)}
-        lock.release()
-
-    def on_error():
-        lock.release()
-
-    # beautiful
-    def do_request():
-        def do_main():
-            aqt.mw.migaku_connection.request_syntax(
-                [{"42": e[1]} for e in entries_list],
-                lang,
-                on_done=on_done,
-                on_error=on_error,
-            )
-
-        lock.acquire()
-        aqt.mw.taskman.run_on_main(do_main)
-        lock.acquire()
-
-    await tornado.ioloop.IOLoop.current().run_in_executor(None, do_request)
+    if isinstance(syntax_data, list) and len(syntax_data) == len(entries_list):
+        result = {e: syntax_data[i]["42"] for i, e in enumerate(entries_list)}
 
     print("syntax took", time.time() - t)
 
@@ -81,36 +76,23 @@ async def build_syntax_cache(entries):
 
 
 async def get_syntax(lang, text):
-    if not aqt.mw.migaku_connection.is_connected():
+    connection = aqt.mw.migaku_connection
+    if not connection.is_connected():
         return None
 
     t = time.time()
 
-    lock = Lock()
+    try:
+        syntax_data = await connection.request_syntax_async(
+            [{"42": text}], lang, timeout=single_syntax_timeout
+        )
+    except (ConnectionError, asyncio.TimeoutError) as e:
+        print("syntax failed:", e)
+        return None
 
     result = None
-
-    def on_done(syntax_data):
-        nonlocal result
-        if isinstance(syntax_data, list) and len(syntax_data) == 1:
-            result = syntax_data[0].get("42")
-        lock.release()
-
-    def on_error():
-        lock.release()
-
-    # beautiful
-    def do_request():
-        def do_main():
-            aqt.mw.migaku_connection.request_syntax(
-                [{"42": text}], lang, on_done=on_done, on_error=on_error
-            )
-
-        lock.acquire()
-        aqt.mw.taskman.run_on_main(do_main)
-        lock.acquire()
-
-    await tornado.ioloop.IOLoop.current().run_in_executor(None, do_request)
+    if isinstance(syntax_data, list) and len(syntax_data) == 1:
+        result = syntax_data[0].get("42")
 
     print("syntax took", time.time() - t)
 
@@ -118,15 +100,48 @@ async def get_syntax(lang, text):
 
 
 upload_host = "https://file-sync-worker-api.migaku.com/data/SRSMEDIA"
-upload_num_threads = 25
+transcode_num_threads = os.cpu_count() or 2
+upload_concurrency = 25
+upload_queue_size = 2 * transcode_num_threads
 upload_data_size = 0
+upload_cache_hits = 0
 
 # THe bundled version of requests on macOS causes issues with SSL :/
 ssl_verify = False
 ssl_warnings_disabled = False
 
-use_curl = None
-curl_path = None
+http_session_lock = Lock()
+http_session_instance = None
+
+transcode_executor_lock = Lock()
+transcode_executor_instance = None
+
+upload_executor_lock = Lock()
+upload_executor_instance = None
+
+upload_client_instance = None
+
+
+def http_session():
+    """Shared keep-alive session, one pooled connection per transcode and upload thread.
+
+    Sessions can be used from multiple threads, the connection pool is thread-safe.
+    """
+    global http_session_instance
+
+    with http_session_lock:
+        if http_session_instance is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=4,
+                # remote media is downloaded from the transcode threads
+                pool_maxsize=transcode_num_threads + upload_concurrency,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            http_session_instance = session
+
+        return http_session_instance
 
 
 def request_retry(method, url, **kwargs):
@@ -143,7 +158,7 @@ def request_retry(method, url, **kwargs):
 
     for i in range(max_retries):
         try:
-            r = requests.request(
+            r = http_session().request(
                 method=method,
                 url=url,
                 timeout=timeout_time,
@@ -172,182 +187,529 @@ def request_retry(method, url, **kwargs):
     return r
 
 
-def put_with_curl(url, data):
-    tmp = tmp_path(uuid.uuid4().hex)
+def media_profile(fname, is_audio=False):
+    # identifies the conversion applied before uploading, part of the cache key
+    if fname.endswith(".webp") or fname.endswith(".m4a"):
+        return "original"
+    if is_audio:
+        return "m4a-128k"
+    return "webp-800"
 
-    with open(tmp, "wb") as f:
-        f.write(data)
 
-    cmd = [curl_path, "-X", "PUT", "-T", tmp, url]
-    r = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+def _read_media(fname):
+    if fname.startswith("http"):
+        try:
+            r = request_retry("GET", fname, max_retries=2)
+        except requests.exceptions.RequestException:
+            r = None
+        if r is None or not r.ok:
+            # ignore remote media that doesn't download correctly
+            return None
+        url = urllib.parse.urlparse(fname)
+        return os.path.basename(url.path), r.content, None
 
-    os.remove(tmp)
+    media_dir = aqt.mw.col.media.dir()
+    path = os.path.join(media_dir, fname)
+    if not os.path.exists(path):
+        # ignore missing media
+        return None
+    with open(path, "rb") as file:
+        return fname, file.read(), path
 
-    return r.returncode
 
+def _transcode_media(fname, data, is_audio=False, path=None):
+    if fname.endswith(".webp") or fname.endswith(".m4a"):
+        # if file is already in target format, use it directly
+        return fname, data
 
-def _upload_media_single_attempt(fname, user_token, is_audio=False):
-    global curl_path
-    global use_curl
+    # ffmpeg reads local media in place instead of from stdin: mp4 based
+    # sources often keep their index at the end of the file, which ffmpeg can
+    # only reach on seekable input. Remote media is passed over stdin.
+    if path:
+        input_args = ["-i", path]
+        input_data = None
+    else:
+        input_args = ["-i", "pipe:0"]
+        input_data = data
+
+    out_path = None
+    try:
+        if is_audio:
+            out_fname = os.path.splitext(fname)[0] + ".m4a"
+            # m4a needs seekable output to write its index with the duration,
+            # so audio is written to a temporary file instead of stdout
+            out_path = tmp_path(uuid.uuid4().hex + "-" + out_fname)
+            # The arguments to ffmpeg are the same as in MM
+            aqt.mw.migaku_connection.ffmpeg.output(
+                "-y",
+                *input_args,
+                "-vn",
+                "-b:a",
+                "128k",
+                out_path,
+                input=input_data,
+            )
+            with open(out_path, "rb") as file:
+                out_data = file.read()
+        else:
+            # We assume that if something is not audio, it is a picture
+            out_fname = os.path.splitext(fname)[0] + ".webp"
+            # The arguments to ffmpeg are the same as in MM
+            out_data = aqt.mw.migaku_connection.ffmpeg.output(
+                *input_args,
+                "-vf",
+                "scale='min(800,iw)':-1",
+                "-f",
+                "webp",
+                "pipe:1",
+                input=input_data,
+            )
+    except Exception as e:
+        print(f"File conversion failed: {e}")
+        # use original file in case of error
+        return fname, data
+    finally:
+        if out_path:
+            try:
+                os.remove(out_path)
+            except OSError:
+                pass
+
+    if not out_data:
+        # ignore failed conversions, most likely bad audio
+        return None
+
+    return out_fname, out_data
+
+
+@dataclass
+class PreparedMedia:
+    src: str
+    fname: str = ""
+    data: bytes = b""
+    hash: str = ""
+    profile: str = ""
+    source_size: int = 0
+    r2_path: Optional[str] = None
+    # local file the media was read from, None for remote media
+    path: Optional[str] = None
+
+
+def _hash_media(src, is_audio=False, account=""):
+    """Read and hash a media file and look it up in the upload cache of account.
+
+    Returns None for media that should be skipped. Media that was uploaded
+    before is returned with r2_path set, otherwise data holds the source file.
+    """
+    global upload_cache_hits
+
+    source = _read_media(src)
+    if source is None:
+        return None
+    fname, data, path = source
+
+    media = PreparedMedia(
+        src=src,
+        fname=fname,
+        data=data,
+        path=path,
+        hash=content_hash(data),
+        profile=media_profile(fname, is_audio),
+        source_size=len(data),
+    )
+
+    media.r2_path = media_upload_cache.get(account, media.hash, media.profile)
+    if media.r2_path:
+        upload_cache_hits += 1
+        media.data = b""
+
+    return media
+
+
+def _transcode_prepared(media, is_audio=False):
+    transcoded = _transcode_media(media.fname, media.data, is_audio, media.path)
+    if transcoded is None:
+        return None
+    media.fname, media.data = transcoded
+    return media
+
+
+def _prepare_media(src, is_audio=False, account=""):
+    """Read, look up and transcode a media file so that it is ready for uploading."""
+
+    media = _hash_media(src, is_audio, account)
+    if media is None or media.r2_path:
+        return media
+    return _transcode_prepared(media, is_audio)
+
+
+def transcode_executor():
+    global transcode_executor_instance
+
+    with transcode_executor_lock:
+        if transcode_executor_instance is None:
+            transcode_executor_instance = ThreadPoolExecutor(
+                transcode_num_threads, thread_name_prefix="migaku-transcode"
+            )
+        return transcode_executor_instance
 
-    if use_curl is None:
-        use_curl = False
-        if is_mac:
-            curl_path = shutil.which("curl")
-            if curl_path:
-                use_curl = True
 
+def upload_executor():
+    global upload_executor_instance
+
+    with upload_executor_lock:
+        if upload_executor_instance is None:
+            upload_executor_instance = ThreadPoolExecutor(
+                upload_concurrency, thread_name_prefix="migaku-upload"
+            )
+        return upload_executor_instance
+
+
+def _put_media_single_attempt(fname, data, user_token):
     headers = {"Authorization": f"Bearer {user_token}"}
 
-    if fname.startswith("http"):
-        r = request_retry("GET", fname, max_retries=2)
-        if not r.ok:
-            # ignore remote media that doesn't download correctly
-            return None
-        data = r.content
-        url = urllib.parse.urlparse(fname)
-        fname = os.path.basename(url.path)
-    else:
-        media_dir = aqt.mw.col.media.dir()
-        path = os.path.join(media_dir, fname)
-        if not os.path.exists(path):
-            # ignore missing media
-            return None
-        with open(path, "rb") as file:
-            data = file.read()
+    quoted = urllib.parse.quote(fname)
+    r = request_retry(
+        "PUT",
+        f"{upload_host}/{quoted}",
+        headers=headers,
+        data=data,
+    )
 
-    in_path = tmp_path(fname)
-    with open(in_path, "wb") as file:
-        file.write(data)
+    if not r.ok:
+        raise Exception(f"upload failed, requests, {r.status_code}, {r.text}")
 
-    out_path = None
-    try:
-        try:
-            if fname.endswith(".webp") or fname.endswith(".m4a"):
-                # if file is already in target format, use it directly
-                with open(in_path, "rb") as file:
-                    data = file.read()
-            elif is_audio:
-                fname = os.path.splitext(fname)[0] + ".m4a"
-                out_path = tmp_path(fname)
-                # The arguments to ffmpeg are the same as in MM
-                r = aqt.mw.migaku_connection.ffmpeg.call(
-                    "-y",
-                    "-i",
-                    in_path,
-                    "-vn",
-                    "-b:a",
-                    "128k",
-                    out_path,
-                )
-                if r != 0:
-                    # ignore failed conversions, most likely bad audio
-                    return None
-
-                with open(out_path, "rb") as file:
-                    data = file.read()
-
-            else:
-                # We assume that if something is not audio, it is a picture
-                fname = os.path.splitext(fname)[0] + ".webp"
-                out_path = tmp_path(fname)
-
-                # The arguments to ffmpeg are the same as in MM
-                r = aqt.mw.migaku_connection.ffmpeg.call(
-                    "-y",
-                    "-i",
-                    in_path,
-                    "-vf",
-                    "scale='min(800,iw)':-1",
-                    out_path,
-                )
-                if r != 0:
-                    # ignore failed conversions, most likely bad audio
-                    return None
-
-                with open(out_path, "rb") as file:
-                    data = file.read()
-        except Exception as e:
-            print(f"File conversion failed: {e}")
-            # use original file in case of error
-            with open(in_path, "rb") as file:
-                data = file.read()
-
-        quoted = urllib.parse.quote(fname)
-        r = request_retry(
-            "PUT",
-            f"{upload_host}/{quoted}",
-            headers=headers,
-            data=data,
-        )
+    upload_info = r.json()
+    file_path = upload_info["filePath"]
 
-        if not r.ok:
-            raise Exception(f"upload failed, requests, {r.status_code}, {r.text}")
+    global upload_data_size
+    upload_data_size += len(data)
 
-        upload_info = r.json()
-        file_path = upload_info["filePath"]
+    return "r2://" + file_path
 
-        global upload_data_size
-        upload_data_size += len(data)
 
-        return "r2://" + file_path
-    finally:
-        for temporary_path in (in_path, out_path):
-            if not temporary_path:
-                continue
+class PooledUploadClient:
+    """Uploads media for coroutines on the server IOLoop.
+
+    Each PUT request blocks one thread of the upload executor, which limits the
+    uploads in flight across all imports to upload_concurrency. The threads share
+    the keep-alive session, so an import reuses its connections instead of opening
+    one per file. Waiting between retries happens on the IOLoop and does not hold
+    a thread.
+    """
+
+    def __init__(self):
+        self.concurrency = upload_concurrency
+
+    async def put_media(self, media, user_token, max_attempts=5):
+        sleep_time = 0.25
+        loop = tornado.ioloop.IOLoop.current()
+
+        for i in range(max_attempts):
             try:
-                os.remove(temporary_path)
-            except OSError:
-                pass
+                media.r2_path = await loop.run_in_executor(
+                    upload_executor(),
+                    _put_media_single_attempt,
+                    media.fname,
+                    media.data,
+                    user_token,
+                )
+                media_upload_cache.set(
+                    account_key(user_token),
+                    media.hash,
+                    media.profile,
+                    media.r2_path,
+                    media.source_size,
+                )
+                return media.r2_path
+            except Exception as e:
+                print(f"WARNING: Upload failed ({i +1}):", e)
 
+                if i == max_attempts - 1:
+                    # RIP
+                    raise e
 
-def _upload_media(fname, user_token, is_audio=False, max_attempts=5):
-    sleep_time = 0.25
+                await tornado.gen.sleep(sleep_time)
+                sleep_time *= 2
 
-    for i in range(max_attempts):
-        try:
-            return _upload_media_single_attempt(fname, user_token, is_audio)
-        except Exception as e:
-            print(f"WARNING: Upload failed ({i +1}):", e)
+        return None
 
-            if i == max_attempts - 1:
-                # RIP
-                raise e
 
-            time.sleep(sleep_time)
-            sleep_time *= 2
+def upload_client():
+    global upload_client_instance
 
-    return None
+    if upload_client_instance is None:
+        upload_client_instance = PooledUploadClient()
+    return upload_client_instance
 
 
 async def upload_media(fname, user_token, is_audio=False):
-    return await tornado.ioloop.IOLoop.current().run_in_executor(
-        None, _upload_media, fname, user_token, is_audio
+    media = await tornado.ioloop.IOLoop.current().run_in_executor(
+        transcode_executor(), _prepare_media, fname, is_audio, account_key(user_token)
     )
+    if media is None:
+        return None
+    if media.r2_path:
+        return media.r2_path
+    return await upload_client().put_media(media, user_token)
+
+
+class StageStats:
+    def __init__(self, num_workers):
+        self.lock = Lock()
+        self.num_workers = num_workers
+        self.items = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.busy_time = 0.0
+        # time spent waiting on the queue between the stages
+        self.wait_time = 0.0
+
+    def add(self, busy_time, bytes_in=0, bytes_out=0):
+        with self.lock:
+            self.items += 1
+            self.busy_time += busy_time
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def add_wait(self, wait_time):
+        with self.lock:
+            self.wait_time += wait_time
+
+    def to_dict(self):
+        return {
+            "workers": self.num_workers,
+            "items": self.items,
+            "bytesIn": self.bytes_in,
+            "bytesOut": self.bytes_out,
+            "busyTime": self.busy_time,
+            "waitTime": self.wait_time,
+        }
+
+
+class MediaUploadPipeline:
+    """Transcodes and uploads media in two stages with separately sized pools.
+
+    ffmpeg runs on the transcode executor, which has as many threads as there are
+    CPU cores, while uploads run on the threads of the upload executor. The bounded queue in between blocks the transcoders whenever the
+    uploads fall behind, so converted media never piles up in memory.
+
+    Media is hashed before transcoding, files with identical content are only
+    transcoded and uploaded once and share the resulting path.
+    """
+
+    def __init__(self, user_token, transcode_workers=None, queue_size=None):
+        self.user_token = user_token
+        self.account = account_key(user_token)
+        self.client = upload_client()
+        self.transcode_workers = transcode_workers or transcode_num_threads
+        self.upload_workers = self.client.concurrency
+        self.queue_size = queue_size or upload_queue_size
+        self.transcode_stats = StageStats(self.transcode_workers)
+        self.upload_stats = StageStats(self.upload_workers)
+        self.duplicates = 0
+        self.bytes_saved = 0
+        # source size of all media that was transcoded and uploaded
+        self.uploaded_source_bytes = 0
+
+    async def run(self, media):
+        result = {}
+        errors = []
+        # (hash, profile) -> src of the first file with that content
+        unique = {}
+        # src -> (hash, profile) of files whose content is uploaded by another src
+        duplicates = {}
+        upload_queue = tornado.queues.Queue(self.queue_size)
+        loop = tornado.ioloop.IOLoop.current()
+        # shared by all transcode workers
+        pending = iter(list(media))
+
+        async def transcode():
+            for src, is_audio in pending:
+                t = time.time()
+                prepared = await loop.run_in_executor(
+                    transcode_executor(), _hash_media, src, is_audio, self.account
+                )
+                if prepared is None:
+                    self.transcode_stats.add(time.time() - t)
+                    result[src] = None
+                    continue
+                if prepared.r2_path:
+                    self.transcode_stats.add(time.time() - t, prepared.source_size)
+                    result[src] = prepared.r2_path
+                    continue
+
+                key = (prepared.hash, prepared.profile)
+                if key in unique:
+                    self.transcode_stats.add(time.time() - t, prepared.source_size)
+                    duplicates[src] = key
+                    self.duplicates += 1
+                    self.bytes_saved += prepared.source_size
+                    continue
+                unique[key] = src
+
+                prepared = await loop.run_in_executor(
+                    transcode_executor(), _transcode_prepared, prepared, is_audio
+                )
+                if prepared is None:
+                    self.transcode_stats.add(time.time() - t)
+                    result[src] = None
+                    continue
+                self.transcode_stats.add(
+                    time.time() - t, prepared.source_size, len(prepared.data)
+                )
 
+                t = time.time()
+                await upload_queue.put(prepared)
+                self.transcode_stats.add_wait(time.time() - t)
+
+        async def upload():
+            while True:
+                t = time.time()
+                prepared = await upload_queue.get()
+                self.upload_stats.add_wait(time.time() - t)
+                if prepared is None:
+                    return
+
+                t = time.time()
+                try:
+                    result[prepared.src] = await self.client.put_media(
+                        prepared, self.user_token
+                    )
+                except Exception as e:
+                    # keep consuming, otherwise the transcoders block forever
+                    errors.append(e)
+                    continue
+                self.upload_stats.add(time.time() - t, len(prepared.data))
+                self.uploaded_source_bytes += prepared.source_size
 
-def _build_media_cache(media, user_token):
-    r = {}
+        uploads = [
+            asyncio.ensure_future(upload()) for _ in range(self.upload_workers)
+        ]
 
-    def do_upload(fname, is_audio):
-        r[fname] = _upload_media(fname, user_token, is_audio)
+        transcodes = [
+            asyncio.ensure_future(transcode()) for _ in range(self.transcode_workers)
+        ]
 
-    with ThreadPoolExecutor(upload_num_threads) as executor:
-        futures = []
+        try:
+            await asyncio.gather(*transcodes)
+        finally:
+            # a failed transcode must not leave the others running after the uploaders stopped
+            for task in transcodes:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*transcodes, return_exceptions=True)
+            for _ in uploads:
+                await upload_queue.put(None)
+            await asyncio.gather(*uploads)
+
+        if errors:
+            raise errors[0]
+
+        for src, key in duplicates.items():
+            result[src] = result.get(unique[key])
+
+        return result
+
+    def stats(self):
+        return {
+            "transcode": self.transcode_stats.to_dict(),
+            "upload": self.upload_stats.to_dict(),
+            "duplicates": self.duplicates,
+            "bytesSaved": self.bytes_saved,
+        }
+
+
+async def build_media_cache(media, user_token, stats=None):
+    pipeline = MediaUploadPipeline(user_token)
+    t = time.time()
+    r = await pipeline.run(media)
+    media_upload_cache.add_run(pipeline.uploaded_source_bytes, time.time() - t)
+    if stats is not None:
+        stats.update(pipeline.stats())
+    return r
 
-        for fname, is_audio in media:
-            futures.append(executor.submit(do_upload, fname, is_audio))
 
-        for future in futures:
-            future.result()
+@dataclass
+class CardSnapshot:
+    id: int
+    nid: int
+    mid: int
+    ord: int
+    type: int
+    queue: int
+    due: int
+    ivl: int
+    fields: List[str]
+    note_type: dict
+    # scheduler day of the collection when the snapshot was taken
+    today: int = 0
+
+    def note_field(self, name):
+        for i, field in enumerate(self.note_type["flds"]):
+            if field["name"] == name:
+                return self.fields[i]
+        raise KeyError(name)
+
+
+def load_cards(cids: Iterable[int]) -> Dict[int, CardSnapshot]:
+    """Read all cards, notes and note types required for an import page at once.
+
+    Cards that do not exist (anymore) are not contained in the result.
+    """
+
+    col = aqt.mw.col
+    cids = list(cids)
+    if not cids:
+        return {}
 
-    return r
+    rows = col.db.all(
+        f"""
+        SELECT
+            cards.id, cards.nid, cards.ord, cards.type, cards.queue, cards.due,
+            cards.ivl, notes.mid, notes.flds
+        FROM
+            cards
+        JOIN
+            notes
+        ON
+            cards.nid = notes.id
+        WHERE
+            cards.id IN {ids2str(cids)}
+    """
+    )
 
+    note_types = {}
+    snapshots = {}
+    today = col.sched.today
 
-async def build_media_cache(media, user_token):
-    return await tornado.ioloop.IOLoop.current().run_in_executor(
-        None, _build_media_cache, media, user_token
-    )
+    for cid, nid, ord_, type_, queue, due, ivl, mid, flds in rows:
+        if mid not in note_types:
+            note_types[mid] = col.models.get(mid)
+        note_type = note_types[mid]
+        if note_type is None:
+            continue
+
+        snapshots[cid] = CardSnapshot(
+            id=cid,
+            nid=nid,
+            mid=mid,
+            ord=ord_,
+            type=type_,
+            queue=queue,
+            due=due,
+            ivl=ivl,
+            fields=flds.split("\x1f"),
+            note_type=note_type,
+            today=today,
+        )
+
+    # keep the order of the requested card ids
+    return {cid: snapshots[cid] for cid in cids if cid in snapshots}
+
+
+# New (0), Learning (1), Review (2), Relearning (3), User Buried (-2), Sched Buried (-3)
+SUPPORTED_QUEUES = (0, 1, 2, 3, -2, -3)
 
 
 def nt_migaku_lang(nt):
@@ -367,6 +729,140 @@ def nt_migaku_lang(nt):
     return lang
 
 
+@dataclass
+class CardPlan:
+    """How cards of one note type and template are converted to one Migaku card type.
+
+    Plans without dst_id describe why such cards are skipped.
+    """
+
+    src_id: str
+    dst_id: Optional[int] = None
+    card_type: Optional[dict] = None
+    lang_obj: object = None
+    # (source field index, destination field index) pairs
+    field_map: List[Tuple[int, int]] = field(default_factory=list)
+    # field type of every destination field
+    field_types: List[str] = field(default_factory=list)
+    skip_reason: Optional[str] = None
+    # short identifier of the skip reason, used for import estimates
+    skip_code: Optional[str] = None
+
+
+class CardPlanner:
+    """Resolves mappings, card types and languages once per note type, template
+    and destination card type instead of once per card.
+    """
+
+    def __init__(self, lang=None, mappings=None, card_types=None):
+        self.lang = lang
+        # the first mapping of a card type wins
+        self.mappings = {}
+        for mapping in mappings or []:
+            self.mappings.setdefault(mapping["srcId"], mapping)
+        self.card_types = card_types or []
+        self.card_types_by_id = {ctype["id"]: ctype for ctype in self.card_types}
+        self.note_type_infos = {}
+        self.plans = {}
+
+    def note_type_info(self, note_type):
+        mid = note_type["id"]
+        info = self.note_type_infos.get(mid)
+        if info is None:
+            nt_lang = nt_migaku_lang(note_type)
+            sub_id_fields = []
+            if nt_lang:
+                names = [fld["name"] for fld in note_type["flds"]]
+                for name, bit in [("Is Vocabulary Card", 1), ("Is Audio Card", 2)]:
+                    if name not in names:
+                        break
+                    sub_id_fields.append((names.index(name), bit))
+            info = (nt_lang, sub_id_fields)
+            self.note_type_infos[mid] = info
+        return info
+
+    def plan(self, card) -> CardPlan:
+        nt_lang, sub_id_fields = self.note_type_info(card.note_type)
+
+        sub_id = 0
+        for idx, bit in sub_id_fields:
+            if card.fields[idx]:
+                sub_id += bit
+
+        key = (card.mid, card.ord, sub_id)
+        plan = self.plans.get(key)
+        if plan is None:
+            plan = self.compile(card.note_type, card.ord, nt_lang, sub_id)
+            self.plans[key] = plan
+        return plan
+
+    def compile(self, note_type, ord_, nt_lang, sub_id) -> CardPlan:
+        plan = CardPlan(src_id=f"{note_type['id']}\u001f{ord_}")
+        field_map = None
+
+        # try to use automatic mapping
+        if nt_lang:
+            for ctype in self.card_types:
+                if (
+                    ctype["lang"] == nt_lang.code.split("_")[0]
+                    and ctype["id"] & 0xF == sub_id
+                ):
+                    plan.dst_id = ctype["id"]
+                    src_names = [fld["name"] for fld in note_type["flds"]]
+                    dst_names = [fld["name"] for fld in ctype["fields"]]
+                    field_map = [
+                        (src_names.index(src), dst_names.index(dst))
+                        for src, dst in auto_field_map
+                        if src in src_names and dst in dst_names
+                    ]
+                    break
+
+        # Also set if note type is not a Migaku note type but has the JS applied
+        lang_obj = nt_lang or note_type_mgr.nt_get_lang(note_type)
+        if lang_obj:
+            if lang_obj.code.split("_")[0] != self.lang:
+                return self.skip(
+                    plan,
+                    "languageMismatch",
+                    f"note type language does not match current language {lang_obj.code} {self.lang}",
+                )
+        if lang_obj is None:
+            for lang_candidate in Languages:
+                if lang_candidate.code.split("_")[0] == self.lang:
+                    lang_obj = lang_candidate
+                    break
+        if lang_obj is None:
+            return self.skip(plan, "noLanguage", "no anki side language found")
+        plan.lang_obj = lang_obj
+
+        # try to use manual mapping
+        if not plan.dst_id:
+            mapping = self.mappings.get(plan.src_id)
+            if mapping:
+                plan.dst_id = mapping["dstId"]
+                field_map = [(fm["srcIdx"], fm["dstIdx"]) for fm in mapping["fields"]]
+
+        # no usable mapping found
+        if not plan.dst_id:
+            return self.skip(plan, "noMapping", f"no mapping for {plan.src_id}")
+
+        # get the correct card type
+        card_type = self.card_types_by_id.get(plan.dst_id)
+        if card_type is None:
+            return self.skip(plan, "noCardType", f"no card type for {plan.dst_id}")
+
+        plan.card_type = card_type
+        plan.field_map = field_map
+        plan.field_types = [fld["type"] for fld in card_type["fields"]]
+        return plan
+
+    def skip(self, plan, code, reason) -> CardPlan:
+        plan.dst_id = None
+        plan.skip_code = code
+        plan.skip_reason = reason
+        return plan
+
+
 async def handle_card(
     cid,
     user_token=None,
@@ -379,135 +875,59 @@ async def handle_card(
     gather_syntax=None,
     media_cache=None,
     syntax_cache=None,
+    snapshot=None,
+    planner=None,
 ):
-    if not mappings:
-        mappings = []
-    if not card_types:
-        card_types = []
-
     if not media_cache:
         media_cache = {}
     if not syntax_cache:
         syntax_cache = {}
 
-    card = aqt.mw.col.get_card(cid)
-    note = card.note()
-    note_type = note.note_type()
-
-    dst_id = None
-    src_id = None
-    field_map = None
-
-    # try to use automatic mapping
-    nt_lang = nt_migaku_lang(note_type)  # only set if note type is a Migaku note type
-    if nt_lang:
-        sub_id = 0
-        try:
-            if note["Is Vocabulary Card"]:
-                sub_id += 1
-            if note["Is Audio Card"]:
-                sub_id += 2
-        except KeyError:
-            pass
-        for ctype in card_types:
-            if (
-                ctype["lang"] == nt_lang.code.split("_")[0]
-                and ctype["id"] & 0xF == sub_id
-            ):
-                dst_id = ctype["id"]
-                src_id = f"{note.mid}\u001f{card.ord}"
-                field_map = []
-                for src, dst in auto_field_map:
-                    for i, field in enumerate(note_type["flds"]):
-                        if field["name"] == src:
-                            src_idx = i
-                            break
-                    else:
-                        continue
-                    for i, field in enumerate(ctype["fields"]):
-                        if field["name"] == dst:
-                            dst_idx = i
-                            break
-                    else:
-                        continue
-                    field_map.append(
-                        {
-                            "srcIdx": src_idx,
-                            "dstIdx": dst_idx,
-                        }
-                    )
-                break
-
-    # Also set if note type is not a Migaku note type but has the JS applied
-    lang_obj = nt_lang or note_type_mgr.nt_get_lang(note_type)
-    if lang_obj:
-        if lang_obj.code.split("_")[0] != lang:
-            print(
-                f"skipped {card.id}: note type language does not match current language",
-                lang_obj.code,
-                lang,
-            )
-            return None
-    if lang_obj is None:
-        for lang_candidate in Languages:
-            if lang_candidate.code.split("_")[0] == lang:
-                lang_obj = lang_candidate
-                break
-    if lang_obj is None:
-        print(f"skipped {card.id}: no anki side language found")
+    # callers handling many cards should pass snapshots obtained by load_cards
+    if snapshot is None:
+        snapshot = (await col_access.run(load_cards, [cid])).get(cid)
+    card = snapshot
+    if card is None:
+        print(f"skipped {cid}: card not found")
         return None
 
-    # try to use manual mapping
-    if not dst_id:
-        # get the correct mapping
-        src_id = f"{note.mid}\u001f{card.ord}"
-
-        for mapping in mappings:
-            if mapping["srcId"] == src_id:
-                field_map = mapping["fields"]
-                dst_id = mapping["dstId"]
-                break
-
-    # no usable mapping found
-    if not dst_id:
-        print(f"skipped {card.id}: no mapping for {src_id}")
+    # the same plan is reused for all cards of a note type and template
+    if planner is None:
+        planner = CardPlanner(lang=lang, mappings=mappings, card_types=card_types)
+    plan = planner.plan(card)
+    if plan.skip_reason:
+        print(f"skipped {card.id}: {plan.skip_reason}")
         return None
 
-    # get the correct card type
-    for ctype in card_types:
-        if ctype["id"] == dst_id:
-            card_type = ctype
-            break
-    else:
-        print(f"skipped {card.id}: no card type for {dst_id}")
-        return None
+    dst_id = plan.dst_id
+    src_id = plan.src_id
+    lang_obj = plan.lang_obj
+    field_types = plan.field_types
 
-    data = [""] * len(card_type["fields"])
+    data = [""] * len(field_types)
 
-    for fm in field_map:
-        src_idx = fm["srcIdx"]
-        dst_idx = fm["dstIdx"]
+    for src_idx, dst_idx in plan.field_map:
         if data[dst_idx]:
             data[dst_idx] += "<br>"
-        data[dst_idx] += note.fields[src_idx].strip()
+        data[dst_idx] += card.fields[src_idx].strip()
 
     # recovered audio/images get appended to the first fitting field
     recovered_audio_src = []
     recovered_images_src = []
 
-    for i, field in enumerate(card_type["fields"]):
-        if not field["type"].startswith("IMAGE"):
+    for i, field_type in enumerate(field_types):
+        if not field_type.startswith("IMAGE"):
             for _, src, _ in IMG_RE.findall(data[i]):
                 recovered_images_src.append(src)
             data[i] = IMG_RE.sub("", data[i])
-        if not field["type"].startswith("AUDIO"):
+        if not field_type.startswith("AUDIO"):
             for src in SOUND_RE.findall(data[i]):
                 recovered_audio_src.append(src)
             data[i] = SOUND_RE.sub("", data[i])
 
     # upload media, including recovered, format as required by field type
-    for i, field in enumerate(card_type["fields"]):
-        if field["type"].startswith("IMAGE"):
+    for i, field_type in enumerate(field_types):
+        if field_type.startswith("IMAGE"):
             hashes = []
             srcs = [src for _, src, _ in IMG_RE.findall(data[i])] + recovered_images_src
             recovered_images_src = []
@@ -526,7 +946,7 @@ async def handle_card(
             if hashes:
                 data[i] = "|".join(hashes)
 
-        elif field["type"].startswith("AUDIO"):
+        elif field_type.startswith("AUDIO"):
             hashes = []
             srcs = SOUND_RE.findall(data[i]) + recovered_audio_src
             recovered_audio_src = []
@@ -545,7 +965,7 @@ async def handle_card(
             if hashes:
                 data[i] = "|".join(hashes)
 
-        elif field["type"] == "SYNTAX":
+        elif field_type == "SYNTAX":
             if data[i].strip() and not "[" in data[i]:
                 if gather_syntax is None:
                     syntax = syntax_cache.get((lang, data[i]))
@@ -577,13 +997,12 @@ async def handle_card(
     if preview:
         return card_data
 
-    # New (0), Learning (1), Review (2), Relearning (3), User Buried (-2), Sched Buried (-3)
-    if card.queue in (0, 1, 2, 3, -2, -3):
+    if card.queue in SUPPORTED_QUEUES:
         if card.type in (0, 1):
             due = 0
             interval = 0
         else:
-            offset = max(0, card.due - aqt.mw.col.sched.today)
+            offset = max(0, card.due - card.today)
             due = srs_today + offset
             interval = max(1, card.ivl)
     else:
@@ -0,0 +1,124 @@
+import time
+import unicodedata
+from typing import Dict, Iterable
+
+from ..user_database import UserDatabase
+
+
+class SyntaxCache(UserDatabase):
+    """Syntax delivered by the browser extension, by language, reading type and text.
+
+    The syntax depends on the extension and its settings, so entries expire after
+    MAX_AGE and can be cleared manually when they change.
+    Least recently used entries are evicted once MAX_ENTRIES is exceeded. The size
+    is only checked every EVICT_INTERVAL stored entries to avoid counting the
+    table on every write.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS syntax (
+            lang TEXT NOT NULL,
+            reading TEXT NOT NULL,
+            text TEXT NOT NULL,
+            syntax TEXT NOT NULL,
+            created INTEGER NOT NULL,
+            used INTEGER NOT NULL,
+            PRIMARY KEY (lang, reading, text)
+        );
+        CREATE INDEX IF NOT EXISTS syntax_used ON syntax (used);
+    """
+
+    MAX_ENTRIES = 200000
+    MAX_AGE = 30 * 24 * 60 * 60
+    LOOKUP_CHUNK_SIZE = 500
+    EVICT_INTERVAL = 1000
+
+    def __init__(self, file_name: str):
+        super().__init__(file_name)
+        self.hits = 0
+        self.misses = 0
+        self.stored_since_evict = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return unicodedata.normalize("NFC", text)
+
+    def get_many(self, lang: str, reading, texts: Iterable[str]) -> Dict[str, str]:
+        """Returns the cached syntax of all given (normalized) texts that are cached."""
+
+        texts = list(set(texts))
+        reading = str(reading)
+        cutoff = int(time.time()) - self.MAX_AGE
+        r = {}
+        # stay below SQLite's limit of query parameters
+        for i in range(0, len(texts), self.LOOKUP_CHUNK_SIZE):
+            chunk = texts[i : i + self.LOOKUP_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            r.update(
+                self.execute(
+                    f"SELECT text, syntax FROM syntax WHERE lang = ? AND reading = ? AND created >= ? AND text IN ({placeholders})",
+                    lang,
+                    reading,
+                    cutoff,
+                    *chunk,
+                )
+            )
+
+        if r:
+            now = int(time.time())
+            self.executemany(
+                "UPDATE syntax SET used = ? WHERE lang = ? AND reading = ? AND text = ?",
+                [(now, lang, reading, text) for text in r],
+            )
+
+        self.hits += len(r)
+        self.misses += len(texts) - len(r)
+        return r
+
+    def set_many(self, lang: str, reading, syntax_map: Dict[str, str]) -> None:
+        now = int(time.time())
+        reading = str(reading)
+        rows = [
+            (lang, reading, text, syntax, now, now)
+            for text, syntax in syntax_map.items()
+            if isinstance(syntax, str)
+        ]
+        self.executemany(
+            "INSERT OR REPLACE INTO syntax (lang, reading, text, syntax, created, used) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+        self.stored_since_evict += len(rows)
+        if self.stored_since_evict >= self.EVICT_INTERVAL:
+            self.evict()
+
+    def evict(self) -> None:
+        self.stored_since_evict = 0
+        self.execute(
+            "DELETE FROM syntax WHERE created < ?",
+            int(time.time()) - self.MAX_AGE,
+        )
+        (count,) = self.first("SELECT count() FROM syntax")
+        if count <= self.MAX_ENTRIES:
+            return
+        self.execute(
+            "DELETE FROM syntax WHERE rowid IN (SELECT rowid FROM syntax ORDER BY used ASC LIMIT ?)",
+            count - self.MAX_ENTRIES,
+        )
+
+    def clear(self) -> None:
+        self.execute("DELETE FROM syntax")
+
+    def count(self) -> int:
+        (count,) = self.first("SELECT count() FROM syntax")
+        return count
+
+    def stats(self):
+        return {
+            "entries": self.count(),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+syntax_cache = SyntaxCache("syntax_cache.sqlite")
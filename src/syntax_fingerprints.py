@@ -0,0 +1,71 @@
+import hashlib
+from typing import Iterable, Set, Tuple
+
+from .user_database import UserDatabase
+
+
+def fingerprint(lang_code: str, text: str) -> str:
+    return hashlib.sha1(f"{lang_code}\u001f{text}".encode("utf-8")).hexdigest()
+
+
+class SyntaxFingerprints(UserDatabase):
+    """Fingerprints of the syntax free text of note fields, taken when syntax was added.
+
+    A field that still contains syntax and whose syntax free text still matches
+    its fingerprint does not need new syntax.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            nid INTEGER NOT NULL,
+            field TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            PRIMARY KEY (nid, field)
+        );
+    """
+
+    LOOKUP_CHUNK_SIZE = 500
+
+    def up_to_date(
+        self, lang_code: str, fields: Iterable[Tuple[int, str, str, str]]
+    ) -> Set[Tuple[int, str]]:
+        """Takes (note id, field name, field text, syntax free text) tuples and returns
+        (note id, field name) of all fields that do not need new syntax.
+        """
+
+        # fields without syntax always need it
+        candidates = {
+            (nid, field): fingerprint(lang_code, stripped)
+            for nid, field, text, stripped in fields
+            if text != stripped
+        }
+        if not candidates:
+            return set()
+
+        nids = list({nid for nid, _ in candidates})
+        r = set()
+        # stay below SQLite's limit of query parameters
+        for i in range(0, len(nids), self.LOOKUP_CHUNK_SIZE):
+            chunk = nids[i : i + self.LOOKUP_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            for nid, field, hash_ in self.execute(
+                f"SELECT nid, field, hash FROM fingerprints WHERE nid IN ({placeholders})",
+                *chunk,
+            ):
+                if candidates.get((nid, field)) == hash_:
+                    r.add((nid, field))
+        return r
+
+    def record(self, lang_code: str, fields: Iterable[Tuple[int, str, str]]) -> None:
+        """Takes (note id, field name, syntax free text) of fields that just got syntax."""
+
+        self.executemany(
+            "INSERT OR REPLACE INTO fingerprints (nid, field, hash) VALUES (?, ?, ?)",
+            [
+                (nid, field, fingerprint(lang_code, stripped))
+                for nid, field, stripped in fields
+            ],
+        )
+
+
+syntax_fingerprints = SyntaxFingerprints("syntax_fingerprints.sqlite")
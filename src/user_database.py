@@ -0,0 +1,48 @@
+import sqlite3
+from threading import Lock
+
+from .util import user_path
+
+
+class UserDatabase:
+    """SQLite database in the user_files folder that can be shared between threads.
+
+    Subclasses provide the table definitions in SCHEMA.
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, file_name: str):
+        self.path = user_path(file_name)
+        self.lock = Lock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.executescript(self.SCHEMA)
+            self._db.commit()
+        return self._db
+
+    def execute(self, sql, *args):
+        with self.lock:
+            db = self._connect()
+            rows = db.execute(sql, args).fetchall()
+            db.commit()
+            return rows
+
+    def executemany(self, sql, args_seq):
+        with self.lock:
+            db = self._connect()
+            db.executemany(sql, args_seq)
+            db.commit()
+
+    def first(self, sql, *args):
+        rows = self.execute(sql, *args)
+        return rows[0] if rows else None
+
+    def close(self):
+        with self.lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
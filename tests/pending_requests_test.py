@@ -0,0 +1,121 @@
+import importlib.util
+from pathlib import Path
+
+
+module_path = (
+    Path(__file__).parents[1] / "src" / "migaku_connection" / "pending_requests.py"
+)
+spec = importlib.util.spec_from_file_location("pending_requests", module_path)
+pending_requests = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pending_requests)
+
+
+clock = [1000.0]
+pending_requests.time.monotonic = lambda: clock[0]
+
+timers = []
+
+
+def schedule(delay, func):
+    timers.append((clock[0] + delay, func))
+
+
+def advance(to):
+    while timers:
+        timers.sort(key=lambda timer: timer[0])
+        at, func = timers[0]
+        if at > to:
+            break
+        timers.pop(0)
+        clock[0] = at
+        func()
+    clock[0] = to
+
+
+class Handler:
+    def __init__(self):
+        self.log = []
+
+    def error(self, msg):
+        self.log.append(("error", msg))
+
+    def timeout(self, msg):
+        self.log.append(("timeout", msg))
+
+
+def new_requests():
+    requests = pending_requests.PendingRequests(schedule)
+    requests.MAX_IN_FLIGHT = 3
+    requests.MAX_QUEUED = 2
+    return requests
+
+
+# in flight and queue limits
+requests = new_requests()
+sent = []
+handlers = [Handler() for _ in range(7)]
+for i, handler in enumerate(handlers):
+    requests.add(handler, sent.append, timeout=5 if i < 2 else 30)
+
+assert sent == [1, 2, 3]
+assert handlers[5].log == handlers[6].log == [("error", "Too many pending requests.")]
+stats = requests.stats()
+assert stats["inFlight"] == 3 and stats["queued"] == 2 and stats["rejected"] == 2
+
+# a reply frees a slot for the next queued request
+assert requests.pop(3) is handlers[2]
+assert sent == [1, 2, 3, 4]
+
+# the timer wheel expires requests after their deadline, waiting ones get sent
+advance(1004)
+assert handlers[0].log == []
+advance(1007)
+assert handlers[0].log == handlers[1].log == [("timeout", "Request timed out.")]
+assert sent == [1, 2, 3, 4, 5]
+
+# replies after the deadline are counted as late
+assert requests.pop(1) is None
+assert requests.stats()["late"] == 1
+
+# deadlines further away than one round of the wheel still expire on time
+advance(1029)
+assert handlers[3].log == []
+advance(1100)
+assert handlers[3].log == [("timeout", "Request timed out.")]
+assert requests.stats()["pending"] == 0
+assert not timers, "the wheel stops ticking without pending requests"
+
+# the wheel starts again for new requests
+handler = Handler()
+requests.add(handler, lambda msg_id: None, timeout=0.5)
+advance(1102)
+assert handler.log == [("timeout", "Request timed out.")]
+
+# a failing send only fails that request, later requests are still sent
+requests = new_requests()
+sent = []
+
+
+def send_failing_once(msg_id):
+    if msg_id == 1:
+        raise ConnectionError("closed")
+    sent.append(msg_id)
+
+
+failed = Handler()
+requests.add(failed, send_failing_once)
+assert failed.log == [("error", "Sending the request failed: closed")]
+assert not requests.draining and requests.stats()["inFlight"] == 0
+
+requests.add(Handler(), send_failing_once)
+assert sent == [2]
+
+# disconnecting fails everything that is pending
+handlers = [Handler() for _ in range(4)]
+for handler in handlers:
+    requests.add(handler, lambda msg_id: None)
+requests.fail_all("Browser Extension disconnected.")
+assert all(h.log == [("error", "Browser Extension disconnected.")] for h in handlers)
+assert requests.stats()["pending"] == 0
+
+print("✓ pending extension requests are limited, expire and survive failing sends")
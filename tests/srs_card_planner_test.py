@@ -0,0 +1,248 @@
+import importlib.util
+import itertools
+import sys
+import types
+from pathlib import Path
+
+
+root = Path(__file__).parents[1] / "src"
+sys.path.insert(0, str(root / "lib" / "shared"))
+
+
+def stub(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+# srs_util is only importable inside Anki, stand in for everything it imports
+Language = types.SimpleNamespace
+FIELDS = [
+    "Sentence",
+    "Translation",
+    "Target Word",
+    "Definitions",
+    "Is Vocabulary Card",
+    "Is Audio Card",
+]
+ja = Language(code="ja", fields=FIELDS)
+zh = Language(code="zh_CN", fields=FIELDS)
+languages = [ja, zh]
+
+
+stub("aqt", mw=None)
+stub("anki")
+stub("anki.utils", ids2str=None)
+stub("requests", Session=None, exceptions=None)
+stub("requests.adapters", HTTPAdapter=None)
+stub("urllib3", disable_warnings=None)
+stub("srs", __path__=[str(root)])
+stub("srs.migaku_connection", __path__=[str(root / "migaku_connection")])
+stub(
+    "srs.note_type_mgr",
+    NOTE_TYPE_PREFIX="Migaku ",
+    NOTE_TYPE_MARK_CSS="/* Migaku */",
+    nt_get_lang=lambda nt: nt["lang"],
+)
+stub("srs.languages", Languages=languages)
+stub("srs.util", tmp_path=None)
+stub("srs.migaku_connection.col_access")
+stub(
+    "srs.migaku_connection.media_upload_cache",
+    account_key=None,
+    content_hash=None,
+    media_upload_cache=None,
+)
+
+spec = importlib.util.spec_from_file_location(
+    "srs.migaku_connection.srs_util", root / "migaku_connection" / "srs_util.py"
+)
+srs_util = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(srs_util)
+
+
+def note_type(mid, field_names, lang=None, migaku=True):
+    return {
+        "id": mid,
+        "name": "Migaku Japanese" if migaku else "Basic",
+        "css": "/* Migaku */" if migaku else "",
+        "flds": [{"name": name} for name in field_names],
+        "lang": lang,
+    }
+
+
+def card(nt, ord_=0, fields=None):
+    return types.SimpleNamespace(
+        mid=nt["id"],
+        ord=ord_,
+        fields=fields if fields is not None else [""] * len(nt["flds"]),
+        note_type=nt,
+    )
+
+
+def card_type(id_, lang, field_names):
+    return {
+        "id": id_,
+        "lang": lang,
+        "fields": [{"name": name, "type": "TEXT"} for name in field_names],
+    }
+
+
+CARD_TYPE_FIELDS = ["Sentence", "Translated Sentence", "Word", "Definitions"]
+card_types = [
+    card_type(0x10, "ja", CARD_TYPE_FIELDS),
+    card_type(0x11, "ja", CARD_TYPE_FIELDS),
+    card_type(0x12, "ja", CARD_TYPE_FIELDS),
+    card_type(0x13, "ja", CARD_TYPE_FIELDS),
+    card_type(0x20, "zh", CARD_TYPE_FIELDS),
+    card_type(0x30, "ja", ["Front", "Back"]),
+]
+
+migaku_nt = note_type(1, FIELDS, ja)
+# a Migaku note type without the "Is Audio Card" field
+no_audio_nt = note_type(2, FIELDS[:5], Language(code="ja", fields=FIELDS[:5]))
+basic_nt = note_type(3, ["Front", "Back"], migaku=False)
+zh_nt = note_type(4, FIELDS, zh)
+ja_js_nt = note_type(5, ["Front", "Back"], ja, migaku=False)
+
+mappings = [
+    {"srcId": "3\u001f0", "dstId": 0x30, "fields": [{"srcIdx": 0, "dstIdx": 1}]},
+    {"srcId": "3\u001f0", "dstId": 0x10, "fields": [{"srcIdx": 1, "dstIdx": 0}]},
+    {"srcId": "5\u001f0", "dstId": 0x30, "fields": [{"srcIdx": 1, "dstIdx": 0}]},
+    {"srcId": "3\u001f1", "dstId": 0x99, "fields": []},
+]
+
+planner = srs_util.CardPlanner("ja", mappings, card_types)
+
+
+def fields_with(nt, **values):
+    names = [fld["name"] for fld in nt["flds"]]
+    fields = [""] * len(names)
+    for name, value in values.items():
+        fields[names.index(name.replace("_", " "))] = value
+    return fields
+
+
+# automatic mapping picks the card type by vocabulary and audio bits
+plan = planner.plan(card(migaku_nt))
+assert plan.dst_id == 0x10
+assert plan.field_map == [(0, 0), (1, 1), (2, 2), (3, 3)]
+assert plan.field_types == ["TEXT"] * 4
+plan = planner.plan(
+    card(migaku_nt, fields=fields_with(migaku_nt, Is_Vocabulary_Card="x", Is_Audio_Card="x"))
+)
+assert plan.dst_id == 0x13
+
+# a missing "Is Audio Card" field keeps the vocabulary bit
+plan = planner.plan(
+    card(no_audio_nt, fields=fields_with(no_audio_nt, Is_Vocabulary_Card="x"))
+)
+assert plan.dst_id == 0x11
+
+# manual mapping, the first mapping of a card type wins
+plan = planner.plan(card(basic_nt))
+assert plan.dst_id == 0x30
+assert plan.field_map == [(0, 1)]
+
+# non Migaku note types with the language applied use their manual mapping
+plan = planner.plan(card(ja_js_nt))
+assert plan.dst_id == 0x30
+assert plan.field_map == [(1, 0)]
+
+# other languages are skipped
+plan = planner.plan(card(zh_nt))
+assert plan.dst_id is None
+assert plan.skip_code == "languageMismatch"
+
+plan = planner.plan(card(basic_nt, ord_=1))
+assert plan.skip_code == "noCardType"
+plan = planner.plan(card(basic_nt, ord_=2))
+assert plan.skip_code == "noMapping"
+assert srs_util.CardPlanner("ko", mappings, card_types).plan(card(basic_nt)).skip_code == "noLanguage"
+
+# plans are compiled once per note type, template and sub id
+assert planner.plan(card(migaku_nt)) is planner.plan(card(migaku_nt))
+
+print("✓ card planner resolves mappings once per card type")
+
+
+def old_plan(nt, ord_, fields, lang, mappings, card_types):
+    """The per card resolution handle_card used before CardPlanner."""
+
+    note = dict(zip([fld["name"] for fld in nt["flds"]], fields))
+    dst_id = None
+    field_map = None
+
+    nt_lang = srs_util.nt_migaku_lang(nt)
+    if nt_lang:
+        sub_id = 0
+        try:
+            if note["Is Vocabulary Card"]:
+                sub_id += 1
+            if note["Is Audio Card"]:
+                sub_id += 2
+        except KeyError:
+            pass
+        for ctype in card_types:
+            if ctype["lang"] == nt_lang.code.split("_")[0] and ctype["id"] & 0xF == sub_id:
+                dst_id = ctype["id"]
+                field_map = []
+                for src, dst in srs_util.auto_field_map:
+                    for i, fld in enumerate(nt["flds"]):
+                        if fld["name"] == src:
+                            src_idx = i
+                            break
+                    else:
+                        continue
+                    for i, fld in enumerate(ctype["fields"]):
+                        if fld["name"] == dst:
+                            dst_idx = i
+                            break
+                    else:
+                        continue
+                    field_map.append((src_idx, dst_idx))
+                break
+
+    lang_obj = nt_lang or srs_util.note_type_mgr.nt_get_lang(nt)
+    if lang_obj and lang_obj.code.split("_")[0] != lang:
+        return None
+    if lang_obj is None and not any(l.code.split("_")[0] == lang for l in languages):
+        return None
+
+    if not dst_id:
+        src_id = f"{nt['id']}\u001f{ord_}"
+        for mapping in mappings:
+            if mapping["srcId"] == src_id:
+                field_map = [(fm["srcIdx"], fm["dstIdx"]) for fm in mapping["fields"]]
+                dst_id = mapping["dstId"]
+                break
+
+    if not dst_id or not any(ctype["id"] == dst_id for ctype in card_types):
+        return None
+    return dst_id, field_map
+
+
+for lang in ["ja", "zh", "ko"]:
+    planner = srs_util.CardPlanner(lang, mappings, card_types)
+    for nt, ord_, vocab, audio in itertools.product(
+        [migaku_nt, no_audio_nt, basic_nt, zh_nt, ja_js_nt], [0, 1, 2], ["", "x"], ["", "x"]
+    ):
+        names = [fld["name"] for fld in nt["flds"]]
+        fields = [""] * len(names)
+        if "Is Vocabulary Card" in names:
+            fields[names.index("Is Vocabulary Card")] = vocab
+        if "Is Audio Card" in names:
+            fields[names.index("Is Audio Card")] = audio
+
+        plan = planner.plan(card(nt, ord_, fields))
+        new = (plan.dst_id, plan.field_map) if plan.dst_id else None
+        assert new == old_plan(nt, ord_, fields, lang, mappings, card_types), (
+            nt["id"],
+            ord_,
+            vocab,
+            audio,
+            lang,
+        )
+
+print("✓ card planner agrees with the previous per card resolution")
@@ -0,0 +1,70 @@
+import importlib.util
+import sqlite3
+from pathlib import Path
+
+
+module_path = Path(__file__).parents[1] / "src" / "migaku_connection" / "srs_sampling.py"
+spec = importlib.util.spec_from_file_location("srs_sampling", module_path)
+srs_sampling = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(srs_sampling)
+
+
+class DB:
+    def __init__(self):
+        self.con = sqlite3.connect(":memory:")
+        self.con.executescript(
+            """
+            CREATE TABLE notes (id INTEGER PRIMARY KEY, mid INTEGER);
+            CREATE TABLE cards (id INTEGER PRIMARY KEY, nid INTEGER, did INTEGER, odid INTEGER, ord INTEGER);
+            """
+        )
+
+    def all(self, sql, *args):
+        return self.con.execute(sql, args).fetchall()
+
+    def list(self, sql, *args):
+        return [row[0] for row in self.all(sql, *args)]
+
+
+db = DB()
+card_id = 0
+
+
+def add_cards(count, mid, ord_, did=1, odid=0):
+    global card_id
+    for _ in range(count):
+        card_id += 1
+        db.con.execute("INSERT INTO notes VALUES (?, ?)", (card_id, mid))
+        db.con.execute(
+            "INSERT INTO cards VALUES (?, ?, ?, ?, ?)", (card_id, card_id, did, odid, ord_)
+        )
+
+
+add_cards(200, mid=10, ord_=0)
+add_cards(30, mid=10, ord_=1)
+add_cards(2, mid=20, ord_=0)
+add_cards(5, mid=20, ord_=0, did=9, odid=1)  # in a filtered deck
+add_cards(100, mid=30, ord_=0, did=2)  # other deck
+
+counts = srs_sampling.card_type_counts(db, 1)
+assert counts == {(10, 0): 200, (10, 1): 30, (20, 0): 7}
+
+allocation = srs_sampling.distribute_slots(counts, 50)
+assert sum(allocation.values()) == 50
+assert allocation[(20, 0)] == 7
+assert allocation[(10, 0)] >= allocation[(10, 1)] >= 1
+
+allocation = srs_sampling.distribute_slots({(1, 0): 1, (1, 1): 1, (2, 0): 1}, 2)
+assert allocation == {(1, 0): 1, (1, 1): 1, (2, 0): 1}
+
+card_ids = srs_sampling.sample_cards(db, 1, 50)
+assert len(card_ids) == len(set(card_ids)) == 50
+sampled_types = set(
+    db.all(
+        f"SELECT notes.mid, cards.ord FROM cards JOIN notes ON cards.nid = notes.id "
+        f"WHERE cards.id IN ({','.join(map(str, card_ids))})"
+    )
+)
+assert sampled_types == set(counts)
+
+print("✓ free trial sampling picks every card type of the deck")